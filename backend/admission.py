@@ -0,0 +1,387 @@
+"""
+准入控制與過載保護（Admission Control / Load Shedding）
+
+班次開始時掃描槍同時湧入的請求會在 threadpool 與資料庫連線池前排隊，
+導致所有請求延遲上升、手持端逾時並改走離線佇列。此模組在路由之前進行：
+
+1. 依路由分類的並發上限（掃描 / 查詢 / 大量處理 / 其他）
+2. 依優先權分配空出的執行槽，`/api/scan` 優先於匯出與列表查詢
+3. 依 client_ip 的 token bucket 限流
+4. 佇列深度或等待時間超過門檻時，立即回應 503 並附帶 Retry-After
+
+環境變數：
+- ADMISSION_CONTROL_ENABLED：是否啟用（預設 true）
+- ADMISSION_TOTAL_CONCURRENCY / ADMISSION_MAX_QUEUE：總並發量與總排隊上限
+- ADMISSION_<SCAN|READ|DEFAULT|BULK>_CONCURRENCY / _QUEUE / _MAX_WAIT：各分類的設定
+- ADMISSION_IP_RATE / ADMISSION_IP_BURST：每個用戶端每秒請求數與突發量，預設 0（不限流）。
+  經過反向代理時所有手持端的連線來源都是代理的 IP，啟用前須設定 ADMISSION_TRUSTED_PROXIES，
+  否則限流會變成所有用戶端共用的總量上限
+- ADMISSION_TRUSTED_PROXIES：可信任的反向代理 IP 或網段（逗號分隔），
+  只有來自這些位址的請求才會依 X-Forwarded-For 判斷用戶端 IP
+"""
+import asyncio
+import ipaddress
+import math
+import os
+import time
+from typing import Dict, List, Optional, Union
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+
+def _env_int(name: str, default: int) -> int:
+    """讀取整數型環境變數"""
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    """讀取浮點數型環境變數"""
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+class RouteClass:
+    """路由分類的准入設定"""
+
+    def __init__(self, name: str, priority: int, max_concurrency: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.priority = priority  # 數字越小優先權越高
+        self.max_concurrency = max_concurrency  # 該分類同時執行的上限
+        self.max_queue = max_queue  # 該分類允許排隊的數量
+        self.max_wait = max_wait  # 排隊最長等待秒數
+
+    @classmethod
+    def from_env(cls, name: str, priority: int, max_concurrency: int, max_queue: int, max_wait: float):
+        """以 ADMISSION_<NAME>_* 環境變數覆寫預設值"""
+        prefix = f"ADMISSION_{name.upper()}_"
+        return cls(
+            name=name,
+            priority=priority,
+            max_concurrency=_env_int(prefix + "CONCURRENCY", max_concurrency),
+            max_queue=_env_int(prefix + "QUEUE", max_queue),
+            max_wait=_env_float(prefix + "MAX_WAIT", max_wait),
+        )
+
+
+# 不經過准入控制的路徑
+EXEMPT_PATHS = {"/api/health"}
+
+# 大量處理（上傳、匯出、離線同步）
+BULK_PATHS = {"/api/barcodes/bulk", "/api/barcodes/download", "/api/offline-sync"}
+
+# 列表與查詢
+READ_PATHS = {
+    "/api/barcodes",
+    "/api/barcodes/search",
+    "/api/barcodes/date-range",
+    "/api/scan-history",
+    "/api/logs",
+    "/api/stats",
+}
+READ_PREFIXES = ("/api/barcodes/details/",)
+
+
+def classify_route(method: str, path: str) -> Optional[str]:
+    """判斷請求屬於哪個路由分類，回傳 None 代表不受限制"""
+    if method == "OPTIONS" or path in EXEMPT_PATHS:
+        return None
+    if path == "/api/scan":
+        return "scan"
+    if path in BULK_PATHS or (path.startswith(("/api/workspaces/", "/api/jobs/")) and path.endswith(("/export", "/download"))):
+        return "bulk"
+    if path in READ_PATHS or path.startswith(READ_PREFIXES):
+        return "read"
+    return "default"
+
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+def parse_networks(value: str) -> List[Network]:
+    """解析逗號分隔的 IP / 網段"""
+    networks = []
+    for item in value.split(","):
+        item = item.strip()
+        if item:
+            networks.append(ipaddress.ip_network(item, strict=False))
+    return networks
+
+
+def resolve_client_ip(request: Request, trusted_proxies: List[Network]) -> str:
+    """取得用戶端 IP；連線來自可信任的代理時，由 X-Forwarded-For 右側往左找第一個非代理位址"""
+    peer = request.client.host if request.client else "unknown"
+
+    def is_trusted(address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in trusted_proxies)
+
+    if not trusted_proxies or not is_trusted(peer):
+        return peer
+    forwarded = [part.strip() for part in request.headers.get("x-forwarded-for", "").split(",") if part.strip()]
+    for address in reversed(forwarded):
+        if not is_trusted(address):
+            return address
+    return forwarded[0] if forwarded else peer
+
+
+class Overloaded(Exception):
+    """請求被拒絕（過載或超過限流）"""
+
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """簡單的 token bucket"""
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """嘗試取用一個 token，成功回傳 0，否則回傳需等待的秒數"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class _Waiter:
+    """排隊中的請求"""
+
+    def __init__(self, route_class: RouteClass, seq: int, future: asyncio.Future):
+        self.route_class = route_class
+        self.seq = seq
+        self.future = future
+
+    def sort_key(self):
+        return (self.route_class.priority, self.seq)
+
+
+class AdmissionController:
+    """
+    准入控制器
+
+    所有狀態都只在事件迴圈內存取（中間件為 async），因此不需要額外的鎖。
+    """
+
+    def __init__(
+        self,
+        route_classes: List[RouteClass],
+        total_concurrency: int,
+        max_total_queue: int,
+        ip_rate: float,
+        ip_burst: float,
+        enabled: bool = True,
+        trusted_proxies: Optional[List[Network]] = None,
+    ):
+        self.route_classes: Dict[str, RouteClass] = {rc.name: rc for rc in route_classes}
+        self.total_concurrency = total_concurrency
+        self.max_total_queue = max_total_queue
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self.enabled = enabled
+        self.trusted_proxies = trusted_proxies or []
+
+        self._in_flight = 0
+        self._class_in_flight: Dict[str, int] = {name: 0 for name in self.route_classes}
+        self._waiters: List[_Waiter] = []
+        self._seq = 0
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._last_bucket_cleanup = time.monotonic()
+        self._shed_count: Dict[str, int] = {name: 0 for name in self.route_classes}
+        self._rate_limited_count = 0
+
+    @classmethod
+    def from_env(cls):
+        """依環境變數建立控制器
+
+        預設總並發量略小於 SQLAlchemy 預設連線池（5 + 10 overflow），
+        避免請求在連線池前排隊而佔住 threadpool。
+        """
+        route_classes = [
+            RouteClass.from_env("scan", priority=0, max_concurrency=12, max_queue=64, max_wait=1.0),
+            RouteClass.from_env("read", priority=1, max_concurrency=6, max_queue=16, max_wait=2.0),
+            RouteClass.from_env("default", priority=1, max_concurrency=4, max_queue=8, max_wait=2.0),
+            RouteClass.from_env("bulk", priority=2, max_concurrency=2, max_queue=4, max_wait=5.0),
+        ]
+        return cls(
+            route_classes=route_classes,
+            total_concurrency=_env_int("ADMISSION_TOTAL_CONCURRENCY", 12),
+            max_total_queue=_env_int("ADMISSION_MAX_QUEUE", 80),
+            ip_rate=_env_float("ADMISSION_IP_RATE", 0.0),
+            ip_burst=_env_float("ADMISSION_IP_BURST", 40.0),
+            enabled=os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() == "true",
+            trusted_proxies=parse_networks(os.getenv("ADMISSION_TRUSTED_PROXIES", "")),
+        )
+
+    # ---- token bucket ----
+
+    def _check_rate_limit(self, client_ip: str):
+        """檢查 client_ip 是否超過限流"""
+        if self.ip_rate <= 0:
+            return
+        now = time.monotonic()
+        self._cleanup_buckets(now)
+        bucket = self._buckets.get(client_ip)
+        if bucket is None:
+            bucket = TokenBucket(self.ip_rate, self.ip_burst, now)
+            self._buckets[client_ip] = bucket
+        wait = bucket.take(now)
+        if wait > 0:
+            self._rate_limited_count += 1
+            raise Overloaded(429, "請求過於頻繁，請稍候再試", wait)
+
+    def _cleanup_buckets(self, now: float):
+        """清理已補滿的 bucket，避免記憶體無限成長"""
+        if now - self._last_bucket_cleanup < 60:
+            return
+        self._last_bucket_cleanup = now
+        full_after = self.ip_burst / self.ip_rate
+        expired_keys = [k for k, b in self._buckets.items() if now - b.updated > full_after]
+        for key in expired_keys:
+            self._buckets.pop(key, None)
+
+    # ---- 並發槽 ----
+
+    def _has_capacity(self, route_class: RouteClass) -> bool:
+        return (
+            self._in_flight < self.total_concurrency
+            and self._class_in_flight[route_class.name] < route_class.max_concurrency
+        )
+
+    def _take_slot(self, route_class: RouteClass):
+        self._in_flight += 1
+        self._class_in_flight[route_class.name] += 1
+
+    def _queue_depth(self, route_class: RouteClass) -> int:
+        return sum(1 for w in self._waiters if w.route_class is route_class)
+
+    def _retry_after(self, route_class: RouteClass) -> float:
+        """建議的重試秒數（該分類的最長等待時間，至少 1 秒）"""
+        return max(1.0, route_class.max_wait)
+
+    def _reject(self, route_class: RouteClass, reason: str):
+        self._shed_count[route_class.name] += 1
+        raise Overloaded(503, reason, self._retry_after(route_class))
+
+    async def acquire(self, route_class: RouteClass):
+        """取得執行槽，超過佇列或等待門檻時拋出 Overloaded"""
+        # 有相同或更高優先權、且其分類仍有空位的請求在排隊時不可插隊
+        # （只卡在自身分類上限的請求不會阻擋其他分類）
+        blocked = any(
+            w.route_class.priority <= route_class.priority and self._has_capacity(w.route_class)
+            for w in self._waiters
+        )
+        if not blocked and self._has_capacity(route_class):
+            self._take_slot(route_class)
+            return
+
+        if (
+            len(self._waiters) >= self.max_total_queue
+            or self._queue_depth(route_class) >= route_class.max_queue
+        ):
+            self._reject(route_class, "伺服器忙碌中，請稍候再試")
+
+        self._seq += 1
+        waiter = _Waiter(route_class, self._seq, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self._waiters.sort(key=_Waiter.sort_key)
+        # 若仍有空位（例如被阻擋的請求其實都卡在分類上限），依優先權立即分配
+        self._wake_waiters()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=route_class.max_wait)
+        except asyncio.TimeoutError:
+            self._remove_waiter(waiter)
+            if waiter.future.done():
+                # 逾時的同時剛好拿到執行槽，直接使用
+                return
+            self._wake_waiters()
+            self._reject(route_class, "伺服器忙碌中，請稍候再試")
+        except asyncio.CancelledError:
+            # 用戶端中斷連線
+            self._remove_waiter(waiter)
+            if waiter.future.done():
+                self.release(route_class)
+            else:
+                self._wake_waiters()
+            raise
+
+    def _remove_waiter(self, waiter: _Waiter):
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+
+    def release(self, route_class: RouteClass):
+        """釋放執行槽並依優先權喚醒排隊中的請求"""
+        self._in_flight -= 1
+        self._class_in_flight[route_class.name] -= 1
+        self._wake_waiters()
+
+    def _wake_waiters(self):
+        for waiter in list(self._waiters):
+            if self._in_flight >= self.total_concurrency:
+                break
+            if waiter.future.done() or not self._has_capacity(waiter.route_class):
+                continue
+            self._waiters.remove(waiter)
+            self._take_slot(waiter.route_class)
+            waiter.future.set_result(True)
+
+    # ---- 中間件入口 ----
+
+    async def handle(self, request: Request, call_next):
+        """在中間件中呼叫，依分類執行限流與准入"""
+        class_name = classify_route(request.method, request.url.path) if self.enabled else None
+        if class_name is None:
+            return await call_next(request)
+
+        route_class = self.route_classes[class_name]
+        client_ip = resolve_client_ip(request, self.trusted_proxies)
+
+        try:
+            self._check_rate_limit(client_ip)
+            await self.acquire(route_class)
+        except Overloaded as e:
+            return JSONResponse(
+                status_code=e.status_code,
+                content={"detail": e.reason},
+                headers={"Retry-After": str(math.ceil(e.retry_after))},
+            )
+
+        try:
+            return await call_next(request)
+        finally:
+            self.release(route_class)
+
+    def stats(self) -> dict:
+        """目前准入控制狀態"""
+        return {
+            "enabled": self.enabled,
+            "in_flight": self._in_flight,
+            "queued": len(self._waiters),
+            "rate_limited": self._rate_limited_count,
+            "classes": {
+                name: {
+                    "in_flight": self._class_in_flight[name],
+                    "queued": self._queue_depth(rc),
+                    "max_concurrency": rc.max_concurrency,
+                    "max_queue": rc.max_queue,
+                    "max_wait": rc.max_wait,
+                    "shed": self._shed_count[name],
+                }
+                for name, rc in self.route_classes.items()
+            },
+        }
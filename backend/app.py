@@ -1,11 +1,14 @@
-from fastapi import FastAPI, HTTPException, Depends, Response, Request
+from fastapi import FastAPI, HTTPException, Depends, Response, Request, BackgroundTasks
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import Column, Integer, String, DateTime, Float, create_engine, func
+from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean, Text, LargeBinary, UniqueConstraint, create_engine, func, insert
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import sessionmaker, Session, deferred
 from pydantic import BaseModel
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from typing import List, Optional
+import math
 import os
 from dotenv import load_dotenv
 import pytz
@@ -13,6 +16,16 @@ import time
 import pandas as pd
 from io import BytesIO
 import json
+import uuid
+from admission import AdmissionController
+import workspaces
+from db_routing import ReadReplicaRouter, ReadSession
+import profiling
+import jobs
+import rollups
+import scan_log
+from compression import CompressionMiddleware
+from encoding import encoded_response
 
 # 載入環境變數
 load_dotenv()
@@ -24,6 +37,12 @@ def get_taipei_time():
     """取得台北當前時間"""
     return datetime.now(TAIPEI_TZ)
 
+# 一次 IN 查詢的條碼數量上限
+LOOKUP_CHUNK_SIZE = 1000
+
+# 批量上傳回應中條碼清單的筆數上限
+UPLOAD_RESPONSE_LIST_LIMIT = int(os.getenv("UPLOAD_RESPONSE_LIST_LIMIT", "100"))
+
 # 並發控制：防止重複掃描
 recent_scans = {}  # 記住最近的掃描時間
 
@@ -36,14 +55,10 @@ def cleanup_recent_scans():
 
 app = FastAPI(title="Barcode Scanner API", description="條碼掃描系統 API", version="1.0.0")
 
-# CORS 配置
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# 查詢追蹤與效能剖析中間件（最先註冊以位於最內層，只量測路由本身）
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    return await profiling.handle(request, call_next)
 
 # API 日誌記錄中間件
 @app.middleware("http")
@@ -108,20 +123,59 @@ async def log_api_calls(request: Request, call_next):
     
     return response
 
+# 准入控制：過載時直接拒絕，不寫入 API 日誌以免加重資料庫負擔
+admission_controller = AdmissionController.from_env()
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    return await admission_controller.handle(request, call_next)
+
+# 回應壓縮（gzip，另支援 brotli / zstd）
+app.add_middleware(CompressionMiddleware)
+
+# CORS 配置（最後註冊以位於最外層，確保 503/429 回應也帶有 CORS 標頭）
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["Retry-After", "X-Query-Count", "X-Query-Time", "X-Profile-Id"],
+)
+
 # 資料庫配置
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 讀取副本（選用）：DATABASE_READ_URL 未設定時唯讀查詢也使用主資料庫
+read_router = ReadReplicaRouter.from_env(engine)
+ReadSessionLocal = sessionmaker(class_=ReadSession, autocommit=False, autoflush=False, router=read_router)
+
 Base = declarative_base()
 
 # 資料庫模型
+class Workspace(Base):
+    __tablename__ = "workspaces"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), nullable=False)
+    status = Column(String(20), nullable=False, default=workspaces.STATUS_ACTIVE)  # active, closed, archived, dropped
+    created_at = Column(DateTime, default=get_taipei_time)
+    closed_at = Column(DateTime)  # 切換離開的時間
+
+# 以下三個表依 workspace_id 分區（PostgreSQL），主鍵需包含分區鍵
 class BarcodesMaster(Base):
     __tablename__ = "barcodes_master"
+    __table_args__ = (
+        UniqueConstraint("workspace_id", "code", name="uq_barcodes_master_workspace_code"),  # 同一工作區內唯一
+        {"postgresql_partition_by": "LIST (workspace_id)"},
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
-    code = Column(String(100), nullable=False, unique=True, index=True)  # 唯一約束
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    workspace_id = Column(Integer, primary_key=True)
+    code = Column(String(100), nullable=False, index=True)
     total_scan_count = Column(Integer, default=0)  # 總掃描次數
     last_scan_time = Column(DateTime)  # 最後掃描時間
     first_upload_time = Column(DateTime)  # 第一次上傳時間
@@ -132,8 +186,10 @@ class BarcodesMaster(Base):
 
 class UploadRecord(Base):
     __tablename__ = "upload_records"
+    __table_args__ = {"postgresql_partition_by": "LIST (workspace_id)"}
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    workspace_id = Column(Integer, primary_key=True)
     code = Column(String(100), nullable=False, index=True)  # 允許重複
     upload_time = Column(DateTime, nullable=False, default=get_taipei_time)
     upload_batch_id = Column(String(50))  # 批次ID
@@ -141,8 +197,14 @@ class UploadRecord(Base):
 
 class ScanHistory(Base):
     __tablename__ = "scan_history"
+    __table_args__ = (
+        UniqueConstraint("workspace_id", "event_id", name="uq_scan_history_workspace_event"),
+        {"postgresql_partition_by": "LIST (workspace_id)"},
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    workspace_id = Column(Integer, primary_key=True)
+    event_id = Column(String(32))  # 延遲寫入時的記錄編號，重播時用於去重
     barcode = Column(String(100), nullable=False)
     result = Column(String(20), nullable=False)
     timestamp = Column(DateTime, nullable=False, default=get_taipei_time)
@@ -162,6 +224,51 @@ class ApiLog(Base):
     execution_time = Column(Float)  # 執行時間 (毫秒)
     timestamp = Column(DateTime, nullable=False, default=get_taipei_time)
 
+# 每小時統計彙總（每小時分散在多個分片列，查詢時加總）
+class HourlyStat(Base):
+    __tablename__ = "hourly_stats"
+    
+    workspace_id = Column(Integer, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True, index=True)  # 小時起始時間（台北時間）
+    shard = Column(Integer, primary_key=True)
+    scan_total = Column(Integer, nullable=False, default=0)
+    scan_success = Column(Integer, nullable=False, default=0)
+    scan_error = Column(Integer, nullable=False, default=0)
+    upload_count = Column(Integer, nullable=False, default=0)
+
+# 上傳批次統計
+class UploadBatchStat(Base):
+    __tablename__ = "upload_batch_stats"
+    
+    workspace_id = Column(Integer, primary_key=True)
+    batch_id = Column(String(50), primary_key=True)
+    first_upload_time = Column(DateTime, index=True)
+    code_count = Column(Integer, nullable=False, default=0)
+    new_count = Column(Integer)  # 由歷史資料重建的批次沒有此資料
+
+# 背景工作表
+class Job(Base):
+    __tablename__ = "jobs"
+    
+    id = Column(String(32), primary_key=True)
+    job_type = Column(String(30), nullable=False)  # upload, export, offline_sync
+    status = Column(String(20), nullable=False, index=True)  # queued, running, succeeded, failed, cancelled
+    workspace_id = Column(Integer)
+    params = Column(Text)  # 請求參數 (JSON 字串)
+    processed = Column(Integer, default=0)  # 已提交筆數
+    total = Column(Integer, default=0)  # 總筆數
+    result = Column(Text)  # 結果摘要 (JSON 字串)
+    error = Column(String(1000))
+    cancel_requested = Column(Boolean, default=False)
+    artifact = deferred(Column(LargeBinary))  # 產出的檔案
+    artifact_name = Column(String(255))
+    artifact_type = Column(String(100))
+    created_at = Column(DateTime, default=get_taipei_time)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    owner = Column(String(100))  # 持有租約的程序
+    heartbeat_at = Column(DateTime)  # 最後一次提交進度的時間
+
 # Pydantic 模型
 class BarcodeCreate(BaseModel):
     code: str
@@ -237,6 +344,51 @@ class OfflineScanRecord(BaseModel):
 class OfflineSyncRequest(BaseModel):
     records: List[OfflineScanRecord]
 
+class WorkspaceResponse(BaseModel):
+    id: int
+    name: str
+    status: str
+    created_at: Optional[datetime]
+    closed_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+class WorkspaceRotateRequest(BaseModel):
+    name: Optional[str] = None
+
+class TimeseriesPoint(BaseModel):
+    bucket_start: datetime
+    scan_total: int
+    scan_success: int
+    scan_error: int
+    success_ratio: Optional[float] = None
+    upload_count: int
+
+class UploadBatchStatResponse(BaseModel):
+    workspace_id: int
+    batch_id: str
+    first_upload_time: Optional[datetime]
+    code_count: int
+    new_count: Optional[int] = None
+    
+    class Config:
+        from_attributes = True
+
+class JobResponse(BaseModel):
+    id: str
+    job_type: str
+    status: str
+    processed: int
+    total: int
+    progress: float  # 0 ~ 1
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    has_artifact: bool = False
+    created_at: Optional[datetime]
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
 # 資料庫依賴注入
 def get_db():
     db = SessionLocal()
@@ -245,16 +397,73 @@ def get_db():
     finally:
         db.close()
 
+def get_read_db():
+    """唯讀端點使用：優先使用讀取副本，不可用時退回主資料庫"""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# 工作區
+active_workspace_cache = workspaces.ActiveWorkspaceCache()
+
+def load_active_workspace_id() -> int:
+    """從資料庫讀取目前的工作區，不存在時建立預設工作區"""
+    db = SessionLocal()
+    try:
+        workspace = db.query(Workspace).filter(Workspace.status == workspaces.STATUS_ACTIVE).order_by(Workspace.id.desc()).first()
+        if not workspace:
+            # 取得鎖後再確認一次，避免多個程序同時建立預設工作區
+            workspaces.lock_rotation(db.connection())
+            workspace = db.query(Workspace).filter(Workspace.status == workspaces.STATUS_ACTIVE).order_by(Workspace.id.desc()).first()
+        if not workspace:
+            workspace = Workspace(name="default", status=workspaces.STATUS_ACTIVE)
+            db.add(workspace)
+            db.flush()
+        workspaces.create_partitions(db.connection(), workspace.id)
+        db.commit()
+        return workspace.id
+    finally:
+        db.close()
+
+def get_workspace_id() -> int:
+    """依賴注入：目前寫入中的工作區 ID"""
+    return active_workspace_cache.get(load_active_workspace_id)
+
+def get_workspace_or_404(workspace_id: int, db: Session) -> Workspace:
+    workspace = db.query(Workspace).filter(Workspace.id == workspace_id).first()
+    if not workspace:
+        raise HTTPException(status_code=404, detail="工作區不存在")
+    return workspace
+
 @app.get("/api/health")
 def health_check():
     """健康檢查"""
     return {"status": "ok"}
 
+@app.get("/api/admission/stats")
+def get_admission_stats():
+    """准入控制狀態"""
+    return admission_controller.stats()
+
+@app.get("/api/scan-log/stats")
+def get_scan_log_stats():
+    """掃描歷史延遲寫入狀態"""
+    if scan_history_log is None:
+        return {"enabled": False}
+    return scan_history_log.stats()
+
+@app.get("/api/read-replicas")
+def get_read_replica_status():
+    """讀取副本狀態"""
+    return read_router.status()
+
 @app.get("/api/logs", response_model=List[dict])
-def get_api_logs(limit: int = 100, db: Session = Depends(get_db)):
+def get_api_logs(request: Request, limit: int = 100, db: Session = Depends(get_read_db)):
     """獲取 API 日誌"""
     logs = db.query(ApiLog).order_by(ApiLog.timestamp.desc()).limit(limit).all()
-    return [
+    return encoded_response(request, [
         {
             "id": log.id,
             "method": log.method,
@@ -267,16 +476,18 @@ def get_api_logs(limit: int = 100, db: Session = Depends(get_db)):
             "timestamp": log.timestamp
         }
         for log in logs
-    ]
+    ])
     
 
 # API 路由
 @app.get("/api/barcodes", response_model=List[BarcodeResponse])
-def get_barcodes(db: Session = Depends(get_db)):
+def get_barcodes(request: Request, db: Session = Depends(get_read_db), workspace_id: int = Depends(get_workspace_id)):
     """獲取所有條碼（每個條碼只有一條主記錄）"""
     
     # 直接從條碼主表獲取所有記錄
-    barcodes_master = db.query(BarcodesMaster).order_by(BarcodesMaster.last_upload_time.desc()).limit(500).all()
+    barcodes_master = db.query(BarcodesMaster).filter(
+        BarcodesMaster.workspace_id == workspace_id
+    ).order_by(BarcodesMaster.last_upload_time.desc()).limit(500).all()
     
     # 轉換為 BarcodeResponse 格式
     result = []
@@ -291,18 +502,21 @@ def get_barcodes(db: Session = Depends(get_db)):
             first_upload_time=bm.first_upload_time
         ))
     
-    return result
+    return encoded_response(request, result)
 
 @app.post("/api/barcodes/search", response_model=List[BarcodeResponse])
-def search_barcodes(search_request: BarcodeSearchRequest, db: Session = Depends(get_db)):
+def search_barcodes(search_request: BarcodeSearchRequest, request: Request, db: Session = Depends(get_read_db), workspace_id: int = Depends(get_workspace_id)):
     """多筆條碼查詢"""
     if not search_request.codes:
-        return []
+        return encoded_response(request, [])
     
     # 移除空白和重複的條碼
     codes = list(set([code.strip() for code in search_request.codes if code.strip()]))
     
-    barcodes_master = db.query(BarcodesMaster).filter(BarcodesMaster.code.in_(codes)).all()
+    barcodes_master = db.query(BarcodesMaster).filter(
+        BarcodesMaster.workspace_id == workspace_id,
+        BarcodesMaster.code.in_(codes)
+    ).all()
     
     # 轉換為 BarcodeResponse 格式
     result = []
@@ -317,12 +531,12 @@ def search_barcodes(search_request: BarcodeSearchRequest, db: Session = Depends(
             first_upload_time=bm.first_upload_time
         ))
     
-    return result
+    return encoded_response(request, result)
 
 @app.post("/api/barcodes/date-range", response_model=List[BarcodeResponse])
-def get_barcodes_by_date_range(date_request: DateRangeRequest, db: Session = Depends(get_db)):
+def get_barcodes_by_date_range(date_request: DateRangeRequest, request: Request, db: Session = Depends(get_read_db), workspace_id: int = Depends(get_workspace_id)):
     """依日期範圍查詢條碼（從主表查詢）"""
-    query = db.query(BarcodesMaster)
+    query = db.query(BarcodesMaster).filter(BarcodesMaster.workspace_id == workspace_id)
     
     if date_request.start_date:
         # 將日期轉換為該日的開始時間
@@ -351,77 +565,115 @@ def get_barcodes_by_date_range(date_request: DateRangeRequest, db: Session = Dep
             first_upload_time=bm.first_upload_time
         ))
     
-    return result
+    return encoded_response(request, result)
+
+def upload_codes_chunk(db: Session, workspace_id: int, codes: List[str], batch_id: str, upload_time: datetime):
+    """寫入一段上傳記錄（觸發器會自動更新主表），回傳全新與已存在的條碼"""
+    existing_codes = set()
+    for start in range(0, len(codes), LOOKUP_CHUNK_SIZE):
+        existing_codes.update(
+            code for (code,) in db.query(BarcodesMaster.code).filter(
+                BarcodesMaster.workspace_id == workspace_id,
+                BarcodesMaster.code.in_(codes[start:start + LOOKUP_CHUNK_SIZE])
+            )
+        )
+    
+    # 無論是否重複，都要記錄上傳記錄
+    db.execute(insert(UploadRecord), [
+        {
+            "workspace_id": workspace_id,
+            "code": code,
+            "upload_time": upload_time,
+            "upload_batch_id": batch_id,
+            "created_at": upload_time
+        }
+        for code in codes
+    ])
+    
+    new_barcodes = [code for code in codes if code not in existing_codes]
+    existing_barcodes = [code for code in codes if code in existing_codes]
+    rollups.record_upload(db, workspace_id, batch_id, upload_time, len(codes), len(new_barcodes))
+    return new_barcodes, existing_barcodes
+
+def clean_codes(codes: List[str]) -> List[str]:
+    """去除空白與空字串"""
+    return [code.strip() for code in codes if code.strip()]
 
 @app.post("/api/barcodes/bulk")
-def upload_barcodes(barcodes_data: BarcodesBulkCreate, db: Session = Depends(get_db)):
-    """批量上傳條碼 - 新的邏輯支援重複條碼上傳"""
-    if not barcodes_data.codes:
+def upload_barcodes(barcodes_data: BarcodesBulkCreate, db: Session = Depends(get_db), workspace_id: int = Depends(get_workspace_id)):
+    """批量上傳條碼 - 新的邏輯支援重複條碼上傳（大量條碼請改用 /api/jobs/upload）"""
+    codes = clean_codes(barcodes_data.codes)
+    if not codes:
         raise HTTPException(status_code=400, detail="沒有提供條碼")
     
-    new_barcodes = []  # 全新的條碼
-    existing_barcodes = []  # 已存在的條碼
-    current_time = get_taipei_time()
-    
     # 生成批次ID
-    import uuid
     batch_id = str(uuid.uuid4())[:8]
     
-    for code in barcodes_data.codes:
-        if not code.strip():
-            continue
-            
-        code = code.strip()
-        
-        # 檢查條碼是否已存在於主表
-        existing_master = db.query(BarcodesMaster).filter(BarcodesMaster.code == code).first()
-        
-        if existing_master:
-            existing_barcodes.append(code)
-        else:
-            new_barcodes.append(code)
-        
-        # 無論是否重複，都要記錄上傳記錄
-        upload_record = UploadRecord(
-            code=code,
-            upload_time=current_time,
-            upload_batch_id=batch_id
-        )
-        db.add(upload_record)
+    new_barcodes, existing_barcodes = upload_codes_chunk(db, workspace_id, codes, batch_id, get_taipei_time())
     
     # 提交所有上傳記錄（觸發器會自動更新主表）
     db.commit()
     
     # 構建回傳訊息
-    total_count = len([c for c in barcodes_data.codes if c.strip()])
+    total_count = len(codes)
     new_count = len(new_barcodes)
     existing_count = len(existing_barcodes)
     
     message = f"上傳完成！總共 {total_count} 個條碼，全新 {new_count} 個，已存在 {existing_count} 個"
     
+    # 條碼清單只回傳前 UPLOAD_RESPONSE_LIST_LIMIT 筆，避免回應過大
     return {
         "message": message,
         "total": total_count,
         "new_count": new_count,
         "existing_count": existing_count,
-        "new_barcodes": new_barcodes,
-        "existing_barcodes": existing_barcodes,
-        "batch_id": batch_id
+        "new_barcodes": new_barcodes[:UPLOAD_RESPONSE_LIST_LIMIT],
+        "existing_barcodes": existing_barcodes[:UPLOAD_RESPONSE_LIST_LIMIT],
+        "lists_truncated": max(new_count, existing_count) > UPLOAD_RESPONSE_LIST_LIMIT,
+        "batch_id": batch_id,
+        "workspace_id": workspace_id
     }
 
 @app.delete("/api/barcodes/clear", response_model=MessageResponse)
 def clear_all_barcodes(db: Session = Depends(get_db)):
-    """清空所有條碼資料"""
-    # 清空所有表的資料
-    db.query(UploadRecord).delete()
-    db.query(BarcodesMaster).delete()
-    db.query(ScanHistory).delete()
-    db.commit()
+    """清空所有條碼資料（切換到新的工作區，舊資料保留於原工作區）"""
+    workspace = rotate_workspace(db)
+    
+    return MessageResponse(message=f"所有資料已清空，已切換至工作區 {workspace.name}")
+
+# 掃描歷史延遲寫入（SCAN_WRITE_BEHIND=true 時啟用）
+scan_history_log = scan_log.ScanLog(SessionLocal, ScanHistory.__table__, Workspace) if scan_log.SCAN_WRITE_BEHIND else None
+
+def record_scan(db: Session, workspace_id: int, code: str, result: str, current_time: datetime):
+    """記錄一次掃描並提交（條碼主表的變更由呼叫端加入同一個交易）
+    
+    延遲寫入模式下掃描歷史與小時統計由記錄檔批次寫入，只有成功掃描需要提交條碼主表計數。
+    """
+    if scan_history_log is None:
+        db.add(ScanHistory(workspace_id=workspace_id, barcode=code, result=result, timestamp=current_time))
+        rollups.record_scans(db, workspace_id, [(current_time, result)])
+        db.commit()
+        return
+    
+    if result != 'success':
+        scan_history_log.append(workspace_id, code, result, current_time)
+        # 失敗的掃描只有查詢，結束交易以儘早歸還連線
+        db.rollback()
+        return
     
-    return MessageResponse(message="所有資料已清空")
+    # 先寫入記錄檔（等待 fsync），再提交計數，提交時才取得條碼主表的列鎖；
+    # 提交失敗時取消該筆記錄，避免重試後重複計入掃描歷史
+    event_id = scan_history_log.append(workspace_id, code, result, current_time, pending=True)
+    try:
+        db.commit()
+    except Exception:
+        scan_history_log.abort(event_id)
+        raise
+    finally:
+        scan_history_log.resolve(event_id)
 
 @app.post("/api/scan", response_model=ScanResponse)
-def scan_barcode(scan_data: ScanRequest, db: Session = Depends(get_db)):
+def scan_barcode(scan_data: ScanRequest, db: Session = Depends(get_db), workspace_id: int = Depends(get_workspace_id)):
     """掃描條碼驗證 - 新的邏輯解決重複條碼掃描計數問題"""
     code = scan_data.code.strip()
     current_timestamp = time.time()
@@ -444,7 +696,10 @@ def scan_barcode(scan_data: ScanRequest, db: Session = Depends(get_db)):
     
     try:
         # 查詢條碼主表檢查條碼是否存在
-        barcode_master = db.query(BarcodesMaster).filter(BarcodesMaster.code == code).first()
+        barcode_master = db.query(BarcodesMaster).filter(
+            BarcodesMaster.workspace_id == workspace_id,
+            BarcodesMaster.code == code
+        ).first()
         
         if barcode_master:
             # 條碼存在，確認收單
@@ -456,9 +711,7 @@ def scan_barcode(scan_data: ScanRequest, db: Session = Depends(get_db)):
             barcode_master.updated_at = current_time
             
             # 記錄掃描歷史
-            scan = ScanHistory(barcode=code, result='success', timestamp=current_time)
-            db.add(scan)
-            db.commit()
+            record_scan(db, workspace_id, code, 'success', current_time)
             
             # 返回成功結果
             return ScanResponse(
@@ -471,9 +724,7 @@ def scan_barcode(scan_data: ScanRequest, db: Session = Depends(get_db)):
         else:
             # 條碼不存在，記錄失敗的掃描
             current_time = get_taipei_time()
-            scan = ScanHistory(barcode=code, result='error', timestamp=current_time)
-            db.add(scan)
-            db.commit()
+            record_scan(db, workspace_id, code, 'error', current_time)
             
             return ScanResponse(
                 result="error",
@@ -487,26 +738,33 @@ def scan_barcode(scan_data: ScanRequest, db: Session = Depends(get_db)):
         raise e
 
 @app.get("/api/scan-history", response_model=List[ScanHistoryResponse])
-def get_scan_history(db: Session = Depends(get_db)):
+def get_scan_history(request: Request, db: Session = Depends(get_db), workspace_id: int = Depends(get_workspace_id)):
     """獲取今日掃描歷史"""
     today = datetime.now().date()
     # 使用 func.date() 來提取日期部分進行比較
-    history = db.query(ScanHistory).filter(func.date(ScanHistory.timestamp) == today).order_by(ScanHistory.timestamp.desc()).all()
-    return history
+    history = db.query(ScanHistory).filter(
+        ScanHistory.workspace_id == workspace_id,
+        func.date(ScanHistory.timestamp) == today
+    ).order_by(ScanHistory.timestamp.desc()).all()
+    return encoded_response(request, [ScanHistoryResponse.model_validate(scan) for scan in history])
 
 @app.get("/api/stats", response_model=StatsResponse)
-def get_stats(db: Session = Depends(get_db)):
+def get_stats(db: Session = Depends(get_db), workspace_id: int = Depends(get_workspace_id)):
     """獲取統計資料"""
     # 總條碼數（從主表獲取）
-    total_barcodes = db.query(BarcodesMaster).count()
+    total_barcodes = db.query(BarcodesMaster).filter(BarcodesMaster.workspace_id == workspace_id).count()
     
     # 計算不重複的成功掃描條碼數量
     successful_scans = db.query(ScanHistory.barcode).filter(
+        ScanHistory.workspace_id == workspace_id,
         ScanHistory.result == 'success'
     ).distinct().count()
     
     # 失敗掃描次數
-    failed_scans = db.query(ScanHistory).filter(ScanHistory.result == 'error').count()
+    failed_scans = db.query(ScanHistory).filter(
+        ScanHistory.workspace_id == workspace_id,
+        ScanHistory.result == 'error'
+    ).count()
     
     return StatsResponse(
         total_barcodes=total_barcodes,
@@ -514,178 +772,219 @@ def get_stats(db: Session = Depends(get_db)):
         failed_scans=failed_scans
     )
 
-@app.post("/api/barcodes/download")
-def download_excel(data: DownloadExcelRequest, db: Session = Depends(get_db)):
-    """下載包含詳細資料的excel檔案"""
-    try:
-        download_data = data.data
-        
-        # 檢查是否有資料
-        if not download_data:
-            raise HTTPException(status_code=400, detail="沒有資料可下載")
-        
-        # 準備主要條碼資料
-        main_dict_list = [item.model_dump() for item in download_data]
-        main_df = pd.DataFrame(main_dict_list)
+def build_excel(sheets: dict) -> bytes:
+    """將多個 DataFrame 寫入同一個 Excel 檔案（空的工作表會略過，第一個工作表一律保留）"""
+    output = BytesIO()
+    
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for index, (sheet_name, df) in enumerate(sheets.items()):
+            if index == 0 or not df.empty:
+                df.to_excel(writer, sheet_name=sheet_name, index=False)
         
-        # 重新命名欄位為中文
-        main_df = main_df.rename(columns={
-            'code': '條碼',
-            'upload_time': '最新上傳時間',
-            'last_scan_time': '最後掃描時間',
-            'first_upload_time': '第一次上傳時間',
-            'total_upload_count': '總上傳次數',
-            'scan_count': '掃描次數',
-        })
+        # 調整欄位寬度以便閱讀
+        for sheet_name in writer.sheets:
+            worksheet = writer.sheets[sheet_name]
+            for column in worksheet.columns:
+                max_length = 0
+                column_letter = column[0].column_letter
+                for cell in column:
+                    try:
+                        if len(str(cell.value)) > max_length:
+                            max_length = len(str(cell.value))
+                    except:
+                        pass
+                adjusted_width = min(max_length + 2, 50)  # 限制最大寬度
+                worksheet.column_dimensions[column_letter].width = adjusted_width
+    
+    return output.getvalue()
+
+def excel_response(content: bytes, filename: str) -> Response:
+    return Response(
+        content=content,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}"
+        }
+    )
+
+def build_barcodes_excel(db: Session, workspace_id: int, download_data: List[BarcodeResponse], progress=None) -> bytes:
+    """產生包含上傳記錄與掃描歷史的 Excel，progress(已處理筆數) 會在每個分段後呼叫"""
+    # 準備主要條碼資料
+    main_dict_list = [item.model_dump() for item in download_data]
+    main_df = pd.DataFrame(main_dict_list)
+    
+    # 重新命名欄位為中文
+    main_df = main_df.rename(columns={
+        'code': '條碼',
+        'upload_time': '最新上傳時間',
+        'last_scan_time': '最後掃描時間',
+        'first_upload_time': '第一次上傳時間',
+        'total_upload_count': '總上傳次數',
+        'scan_count': '掃描次數',
+    })
+    
+    # 處理datetime欄位，確保它們可以正確序列化
+    for col in ['最新上傳時間', '最後掃描時間']:
+        if col in main_df.columns:
+            main_df[col] = main_df[col].astype(str)
+    
+    # 準備詳細資料工作表
+    upload_records_data = []
+    scan_history_data = []
+    
+    # 分段一次查詢多個條碼的詳細資料
+    codes = [item.code for item in download_data]
+    for start in range(0, len(codes), LOOKUP_CHUNK_SIZE):
+        chunk = codes[start:start + LOOKUP_CHUNK_SIZE]
+        upload_records_by_code = {}
+        scan_history_by_code = {}
         
-        # 處理datetime欄位，確保它們可以正確序列化
-        for col in ['最新上傳時間', '最後掃描時間']:
-            if col in main_df.columns:
-                main_df[col] = main_df[col].astype(str)
+        # 獲取所有上傳記錄
+        upload_records = db.query(UploadRecord).filter(
+            UploadRecord.workspace_id == workspace_id,
+            UploadRecord.code.in_(chunk)
+        ).order_by(UploadRecord.upload_time.desc()).all()
+        for record in upload_records:
+            upload_records_by_code.setdefault(record.code, []).append(record)
         
-        # 準備詳細資料工作表
-        upload_records_data = []
-        scan_history_data = []
+        # 獲取掃描歷史
+        scan_history = db.query(ScanHistory).filter(
+            ScanHistory.workspace_id == workspace_id,
+            ScanHistory.barcode.in_(chunk)
+        ).order_by(ScanHistory.timestamp.desc()).all()
+        for scan in scan_history:
+            scan_history_by_code.setdefault(scan.barcode, []).append(scan)
         
-        # 獲取每個條碼的詳細資料
-        for barcode_item in download_data:
-            code = barcode_item.code
-            
-            # 獲取所有上傳記錄
-            upload_records = db.query(UploadRecord).filter(
-                UploadRecord.code == code
-            ).order_by(UploadRecord.upload_time.desc()).all()
-            
-            for record in upload_records:
+        # 依原本的條碼順序排列
+        for code in chunk:
+            for record in upload_records_by_code.get(code, []):
                 upload_records_data.append({
                     '條碼': code,
                     '上傳時間': record.upload_time,
                     '批次ID': record.upload_batch_id
                 })
             
-            # 獲取掃描歷史
-            scan_history = db.query(ScanHistory).filter(
-                ScanHistory.barcode == code
-            ).order_by(ScanHistory.timestamp.desc()).all()
-            
-            for scan in scan_history:
+            for scan in scan_history_by_code.get(code, []):
                 scan_history_data.append({
                     '條碼': code,
                     '掃描結果': '收單確認' if scan.result == 'success' else '非收單項目',
                     '掃描時間': scan.timestamp
                 })
         
-        # 創建DataFrame
-        upload_records_df = pd.DataFrame(upload_records_data)
-        scan_history_df = pd.DataFrame(scan_history_data)
-        
-        # 處理datetime欄位
-        if not upload_records_df.empty:
-            for col in ['最新上傳時間', '最後掃描時間']:
-                if col in upload_records_df.columns:
-                    upload_records_df[col] = upload_records_df[col].astype(str)
-        
-        if not scan_history_df.empty:
-            if '掃描時間' in scan_history_df.columns:
-                scan_history_df['掃描時間'] = scan_history_df['掃描時間'].astype(str)
-        
-        # 使用ExcelWriter創建多個工作表
-        output = BytesIO()
+        if progress:
+            progress(start + len(chunk))
+    
+    # 創建DataFrame
+    upload_records_df = pd.DataFrame(upload_records_data)
+    scan_history_df = pd.DataFrame(scan_history_data)
+    
+    # 處理datetime欄位
+    if not upload_records_df.empty:
+        for col in ['最新上傳時間', '最後掃描時間']:
+            if col in upload_records_df.columns:
+                upload_records_df[col] = upload_records_df[col].astype(str)
+    
+    if not scan_history_df.empty:
+        if '掃描時間' in scan_history_df.columns:
+            scan_history_df['掃描時間'] = scan_history_df['掃描時間'].astype(str)
+    
+    # 主要條碼資料工作表、上傳記錄詳細資料工作表、掃描歷史詳細資料工作表
+    return build_excel({
+        '條碼資料': main_df,
+        '上傳記錄詳細': upload_records_df,
+        '掃描歷史詳細': scan_history_df,
+    })
+
+@app.post("/api/barcodes/download")
+def download_excel(data: DownloadExcelRequest, db: Session = Depends(get_read_db), workspace_id: int = Depends(get_workspace_id)):
+    """下載包含詳細資料的excel檔案（大量資料請改用 /api/jobs/export）"""
+    try:
+        download_data = data.data
         
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # 主要條碼資料工作表
-            main_df.to_excel(writer, sheet_name='條碼資料', index=False)
-            
-            # 上傳記錄詳細資料工作表
-            if not upload_records_df.empty:
-                upload_records_df.to_excel(writer, sheet_name='上傳記錄詳細', index=False)
-            
-            # 掃描歷史詳細資料工作表
-            if not scan_history_df.empty:
-                scan_history_df.to_excel(writer, sheet_name='掃描歷史詳細', index=False)
-            
-            # 調整欄位寬度以便閱讀
-            for sheet_name in writer.sheets:
-                worksheet = writer.sheets[sheet_name]
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    adjusted_width = min(max_length + 2, 50)  # 限制最大寬度
-                    worksheet.column_dimensions[column_letter].width = adjusted_width
+        # 檢查是否有資料
+        if not download_data:
+            raise HTTPException(status_code=400, detail="沒有資料可下載")
         
-        output.seek(0)
+        content = build_barcodes_excel(db, workspace_id, download_data)
         
         # 根據資料筆數生成檔案名稱
         filename = f"barcodes_data_{len(download_data)}.xlsx"
         
-        return Response(
-            content=output.getvalue(),
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}"
-            }
-        )
+        return excel_response(content, filename)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"下載Excel失敗: {str(e)}")
 
-@app.post("/api/offline-sync", response_model=MessageResponse)
-def sync_offline_records(sync_request: OfflineSyncRequest, db: Session = Depends(get_db)):
-    """同步離線掃描記錄"""
-    if not sync_request.records:
-        return MessageResponse(message="沒有需要同步的記錄")
+def parse_offline_timestamp(value: str) -> datetime:
+    """解析離線記錄的時間戳"""
+    # 嘗試解析 ISO 格式時間戳
+    if value.endswith('Z'):
+        # UTC 時間，轉換為台北時間
+        timestamp = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        return timestamp.astimezone(TAIPEI_TZ)
     
+    # 假設是台北時間
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is None:
+        timestamp = TAIPEI_TZ.localize(timestamp)
+    return timestamp
+
+def apply_offline_records(db: Session, workspace_id: int, records: List[OfflineScanRecord]):
+    """寫入一段離線掃描記錄（不提交），回傳 (成功數, 失敗數)"""
     synced_count = 0
     error_count = 0
+    synced_scans = []  # (時間, 結果)，用於累加小時統計
+    
+    # 一次查詢所有成功掃描的條碼主表記錄
+    success_codes = list({record.barcode for record in records if record.result == 'success'})
+    masters = {}
+    for start in range(0, len(success_codes), LOOKUP_CHUNK_SIZE):
+        for barcode_master in db.query(BarcodesMaster).filter(
+            BarcodesMaster.workspace_id == workspace_id,
+            BarcodesMaster.code.in_(success_codes[start:start + LOOKUP_CHUNK_SIZE])
+        ):
+            masters[barcode_master.code] = barcode_master
+    
+    for record in records:
+        try:
+            timestamp = parse_offline_timestamp(record.timestamp)
+            
+            # 創建掃描歷史記錄
+            db.add(ScanHistory(
+                workspace_id=workspace_id,
+                barcode=record.barcode,
+                result=record.result,
+                timestamp=timestamp
+            ))
+            
+            # 如果是成功掃描，更新條碼主表的掃描次數
+            if record.result == 'success':
+                barcode_master = masters.get(record.barcode)
+                if barcode_master:
+                    barcode_master.total_scan_count += 1
+                    barcode_master.last_scan_time = timestamp
+                    barcode_master.updated_at = timestamp
+            
+            synced_scans.append((timestamp, record.result))
+            synced_count += 1
+            
+        except Exception as e:
+            error_count += 1
+            continue
+    
+    rollups.record_scans(db, workspace_id, synced_scans)
+    return synced_count, error_count
+
+@app.post("/api/offline-sync", response_model=MessageResponse)
+def sync_offline_records(sync_request: OfflineSyncRequest, db: Session = Depends(get_db), workspace_id: int = Depends(get_workspace_id)):
+    """同步離線掃描記錄（大量記錄請改用 /api/jobs/offline-sync）"""
+    if not sync_request.records:
+        return MessageResponse(message="沒有需要同步的記錄")
     
     try:
-        for record in sync_request.records:
-            try:
-                # 解析時間戳
-                from datetime import datetime
-                import pytz
-                
-                # 嘗試解析 ISO 格式時間戳
-                if record.timestamp.endswith('Z'):
-                    # UTC 時間
-                    timestamp = datetime.fromisoformat(record.timestamp.replace('Z', '+00:00'))
-                    # 轉換為台北時間
-                    taipei_tz = pytz.timezone('Asia/Taipei')
-                    timestamp = timestamp.astimezone(taipei_tz)
-                else:
-                    # 假設是台北時間
-                    timestamp = datetime.fromisoformat(record.timestamp)
-                    if timestamp.tzinfo is None:
-                        taipei_tz = pytz.timezone('Asia/Taipei')
-                        timestamp = taipei_tz.localize(timestamp)
-                
-                # 創建掃描歷史記錄
-                scan_history = ScanHistory(
-                    barcode=record.barcode,
-                    result=record.result,
-                    timestamp=timestamp
-                )
-                db.add(scan_history)
-                
-                # 如果是成功掃描，更新條碼主表的掃描次數
-                if record.result == 'success':
-                    barcode_master = db.query(BarcodesMaster).filter(BarcodesMaster.code == record.barcode).first()
-                    if barcode_master:
-                        barcode_master.total_scan_count += 1
-                        barcode_master.last_scan_time = timestamp
-                        barcode_master.updated_at = timestamp
-                
-                synced_count += 1
-                
-            except Exception as e:
-                error_count += 1
-                continue
+        synced_count, error_count = apply_offline_records(db, workspace_id, sync_request.records)
         
         # 提交所有變更
         db.commit()
@@ -700,22 +999,27 @@ def sync_offline_records(sync_request: OfflineSyncRequest, db: Session = Depends
 
 
 @app.get("/api/barcodes/details/{code}")
-def get_barcode_details(code: str, db: Session = Depends(get_db)):
+def get_barcode_details(code: str, db: Session = Depends(get_read_db), workspace_id: int = Depends(get_workspace_id)):
     """獲取指定條碼的所有上傳記錄和掃描歷史"""
     try:
         # 獲取條碼主表記錄
-        barcode_master = db.query(BarcodesMaster).filter(BarcodesMaster.code == code).first()
+        barcode_master = db.query(BarcodesMaster).filter(
+            BarcodesMaster.workspace_id == workspace_id,
+            BarcodesMaster.code == code
+        ).first()
         
         if not barcode_master:
             raise HTTPException(status_code=404, detail="條碼不存在")
         
         # 獲取所有上傳記錄（按上傳時間排序）
         upload_records = db.query(UploadRecord).filter(
+            UploadRecord.workspace_id == workspace_id,
             UploadRecord.code == code
         ).order_by(UploadRecord.upload_time.desc()).all()
         
         # 獲取掃描歷史（按掃描時間排序）
         scan_history = db.query(ScanHistory).filter(
+            ScanHistory.workspace_id == workspace_id,
             ScanHistory.barcode == code
         ).order_by(ScanHistory.timestamp.desc()).all()
         
@@ -755,6 +1059,396 @@ def get_barcode_details(code: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"獲取詳細資料失敗: {str(e)}")
 
 
+# 工作區管理
+def rotate_workspace(db: Session, name: Optional[str] = None) -> Workspace:
+    """切換到新的工作區：建立新分區並關閉目前的工作區，耗時與資料量無關"""
+    # 同時切換（例如重複點擊清空）時依序執行，確保只有一個 active 工作區
+    workspaces.lock_rotation(db.connection())
+    current_time = get_taipei_time()
+    
+    db.query(Workspace).filter(Workspace.status == workspaces.STATUS_ACTIVE).update(
+        {"status": workspaces.STATUS_CLOSED, "closed_at": current_time},
+        synchronize_session=False
+    )
+    workspace = Workspace(
+        name=name or current_time.strftime("%Y%m%d-%H%M%S"),
+        status=workspaces.STATUS_ACTIVE,
+        created_at=current_time
+    )
+    db.add(workspace)
+    db.flush()
+    workspaces.create_partitions(db.connection(), workspace.id)
+    db.commit()
+    
+    active_workspace_cache.set(workspace.id)
+    return workspace
+
+def ensure_workspace_settled(db: Session, workspace: Workspace):
+    """剛關閉的工作區可能仍有其他程序（快取尚未過期）在寫入，暫不允許封存或刪除"""
+    ttl = active_workspace_cache.ttl
+    recently_closed = db.query(Workspace.id).filter(
+        Workspace.id == workspace.id,
+        Workspace.closed_at > func.now() - timedelta(seconds=ttl)
+    ).first()
+    if recently_closed:
+        raise HTTPException(status_code=400, detail=f"工作區剛關閉，請於 {math.ceil(ttl)} 秒後再試")
+
+def drop_workspace_data(workspace_id: int, archived: bool):
+    """背景刪除工作區的分區"""
+    try:
+        with engine.begin() as conn:
+            workspaces.drop_partitions(conn, workspace_id, archived=archived)
+    except Exception as e:
+        print(f"刪除工作區 {workspace_id} 失敗: {e}")
+
+@app.get("/api/workspaces", response_model=List[WorkspaceResponse])
+def list_workspaces(db: Session = Depends(get_db)):
+    """列出所有工作區"""
+    return db.query(Workspace).order_by(Workspace.id.desc()).all()
+
+@app.get("/api/workspaces/active", response_model=WorkspaceResponse)
+def get_active_workspace(db: Session = Depends(get_db), workspace_id: int = Depends(get_workspace_id)):
+    """目前寫入中的工作區"""
+    return get_workspace_or_404(workspace_id, db)
+
+@app.post("/api/workspaces/rotate", response_model=WorkspaceResponse)
+def rotate_workspace_endpoint(rotate_request: WorkspaceRotateRequest, db: Session = Depends(get_db)):
+    """切換到新的工作區（例如新班次）"""
+    return rotate_workspace(db, rotate_request.name)
+
+@app.post("/api/workspaces/{workspace_id}/archive", response_model=WorkspaceResponse)
+def archive_workspace(workspace_id: int, db: Session = Depends(get_db)):
+    """封存工作區：將分區卸載為獨立資料表，保留供稽核"""
+    workspace = get_workspace_or_404(workspace_id, db)
+    if workspace.status != workspaces.STATUS_CLOSED:
+        raise HTTPException(status_code=400, detail="只能封存已關閉的工作區")
+    ensure_workspace_settled(db, workspace)
+    
+    try:
+        workspaces.detach_partitions(db.connection(), workspace_id)
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    workspace.status = workspaces.STATUS_ARCHIVED
+    db.commit()
+    return workspace
+
+@app.delete("/api/workspaces/{workspace_id}", response_model=MessageResponse)
+def drop_workspace(workspace_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    """刪除工作區的所有資料（於背景執行）"""
+    workspace = get_workspace_or_404(workspace_id, db)
+    if workspace.status not in (workspaces.STATUS_CLOSED, workspaces.STATUS_ARCHIVED):
+        raise HTTPException(status_code=400, detail="只能刪除已關閉或已封存的工作區")
+    ensure_workspace_settled(db, workspace)
+    
+    archived = workspace.status == workspaces.STATUS_ARCHIVED
+    workspace.status = workspaces.STATUS_DROPPED
+    db.commit()
+    
+    background_tasks.add_task(drop_workspace_data, workspace_id, archived)
+    return MessageResponse(message=f"工作區 {workspace.name} 刪除中")
+
+@app.get("/api/workspaces/{workspace_id}/export")
+def export_workspace(workspace_id: int, db: Session = Depends(get_read_db)):
+    """匯出工作區的所有資料為 Excel"""
+    workspace = get_workspace_or_404(workspace_id, db)
+    if workspace.status not in (workspaces.STATUS_ACTIVE, workspaces.STATUS_CLOSED):
+        raise HTTPException(status_code=400, detail="工作區資料已封存或刪除，無法匯出")
+    
+    master_df = pd.DataFrame(
+        db.query(
+            BarcodesMaster.code,
+            BarcodesMaster.total_upload_count,
+            BarcodesMaster.total_scan_count,
+            BarcodesMaster.first_upload_time,
+            BarcodesMaster.last_upload_time,
+            BarcodesMaster.last_scan_time,
+        ).filter(BarcodesMaster.workspace_id == workspace_id).all(),
+        columns=['條碼', '總上傳次數', '掃描次數', '第一次上傳時間', '最新上傳時間', '最後掃描時間']
+    )
+    upload_records_df = pd.DataFrame(
+        db.query(
+            UploadRecord.code,
+            UploadRecord.upload_time,
+            UploadRecord.upload_batch_id,
+        ).filter(UploadRecord.workspace_id == workspace_id).order_by(UploadRecord.upload_time).all(),
+        columns=['條碼', '上傳時間', '批次ID']
+    )
+    scan_history_df = pd.DataFrame(
+        db.query(
+            ScanHistory.barcode,
+            ScanHistory.result,
+            ScanHistory.timestamp,
+        ).filter(ScanHistory.workspace_id == workspace_id).order_by(ScanHistory.timestamp).all(),
+        columns=['條碼', '掃描結果', '掃描時間']
+    )
+    scan_history_df['掃描結果'] = scan_history_df['掃描結果'].map(
+        lambda result: '收單確認' if result == 'success' else '非收單項目'
+    )
+    
+    content = build_excel({
+        '條碼資料': master_df.astype(str),
+        '上傳記錄詳細': upload_records_df.astype(str),
+        '掃描歷史詳細': scan_history_df.astype(str),
+    })
+    return excel_response(content, f"workspace_{workspace_id}.xlsx")
+
+
+# 統計分析（查詢彙總表）
+def analytics_range(start: Optional[datetime], end: Optional[datetime]):
+    """預設查詢最近 7 天"""
+    end = rollups.to_local(end) if end else rollups.to_local(get_taipei_time())
+    start = rollups.to_local(start) if start else end - timedelta(days=7)
+    return start, end
+
+@app.get("/api/analytics/timeseries", response_model=List[TimeseriesPoint])
+def get_analytics_timeseries(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    interval: str = "hour",
+    workspace_id: Optional[int] = None,
+    db: Session = Depends(get_read_db)
+):
+    """每小時或每日的掃描與上傳數量（未指定工作區時統計所有工作區）"""
+    if interval not in ("hour", "day"):
+        raise HTTPException(status_code=400, detail="interval 只支援 hour 或 day")
+    start, end = analytics_range(start, end)
+    # 每日統計從當日 00:00 起算，第一天才是完整的一天
+    first_bucket = rollups.day_bucket(start) if interval == "day" else rollups.hour_bucket(start)
+    
+    query = db.query(
+        HourlyStat.bucket_start,
+        func.sum(HourlyStat.scan_total),
+        func.sum(HourlyStat.scan_success),
+        func.sum(HourlyStat.scan_error),
+        func.sum(HourlyStat.upload_count)
+    ).filter(
+        HourlyStat.bucket_start >= first_bucket,
+        HourlyStat.bucket_start <= end
+    )
+    if workspace_id is not None:
+        query = query.filter(HourlyStat.workspace_id == workspace_id)
+    rows = query.group_by(HourlyStat.bucket_start).order_by(HourlyStat.bucket_start).all()
+    
+    # 每日統計由小時統計加總
+    buckets = {}
+    for bucket_start, scan_total, scan_success, scan_error, upload_count in rows:
+        if interval == "day":
+            bucket_start = rollups.day_bucket(bucket_start)
+        totals = buckets.setdefault(bucket_start, [0, 0, 0, 0])
+        totals[0] += scan_total or 0
+        totals[1] += scan_success or 0
+        totals[2] += scan_error or 0
+        totals[3] += upload_count or 0
+    
+    return [
+        TimeseriesPoint(
+            bucket_start=bucket_start,
+            scan_total=scan_total,
+            scan_success=scan_success,
+            scan_error=scan_error,
+            success_ratio=round(scan_success / scan_total, 4) if scan_total else None,
+            upload_count=upload_count
+        )
+        for bucket_start, (scan_total, scan_success, scan_error, upload_count) in buckets.items()
+    ]
+
+@app.get("/api/analytics/upload-batches", response_model=List[UploadBatchStatResponse])
+def get_analytics_upload_batches(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    workspace_id: Optional[int] = None,
+    db: Session = Depends(get_read_db)
+):
+    """每個上傳批次的條碼數量"""
+    start, end = analytics_range(start, end)
+    query = db.query(UploadBatchStat).filter(
+        UploadBatchStat.first_upload_time >= start,
+        UploadBatchStat.first_upload_time <= end
+    )
+    if workspace_id is not None:
+        query = query.filter(UploadBatchStat.workspace_id == workspace_id)
+    return query.order_by(UploadBatchStat.first_upload_time).all()
+
+
+# 背景工作
+job_runner = jobs.JobRunner(SessionLocal, Job, get_taipei_time)
+
+@job_runner.handler("upload")
+def run_upload_job(ctx: jobs.JobContext):
+    """分段寫入上傳記錄，可從上次提交處續跑"""
+    codes = ctx.params["codes"]
+    batch_id = ctx.params["batch_id"]
+    upload_time = datetime.fromisoformat(ctx.params["upload_time"])
+    result = json.loads(ctx.job.result) if ctx.job.result else {
+        "total": len(codes), "new_count": 0, "existing_count": 0, "batch_id": batch_id
+    }
+    
+    for start in range(ctx.processed, len(codes), jobs.JOBS_CHUNK_SIZE):
+        chunk = codes[start:start + jobs.JOBS_CHUNK_SIZE]
+        new_barcodes, existing_barcodes = upload_codes_chunk(ctx.db, ctx.job.workspace_id, chunk, batch_id, upload_time)
+        result["new_count"] += len(new_barcodes)
+        result["existing_count"] += len(existing_barcodes)
+        ctx.checkpoint(start + len(chunk), result)
+    
+    result["message"] = f"上傳完成！總共 {result['total']} 個條碼，全新 {result['new_count']} 個，已存在 {result['existing_count']} 個"
+    return result
+
+@job_runner.handler("offline_sync")
+def run_offline_sync_job(ctx: jobs.JobContext):
+    """分段同步離線掃描記錄，可從上次提交處續跑"""
+    records = [OfflineScanRecord(**record) for record in ctx.params["records"]]
+    result = json.loads(ctx.job.result) if ctx.job.result else {"synced_count": 0, "error_count": 0}
+    
+    for start in range(ctx.processed, len(records), jobs.JOBS_CHUNK_SIZE):
+        chunk = records[start:start + jobs.JOBS_CHUNK_SIZE]
+        synced_count, error_count = apply_offline_records(ctx.db, ctx.job.workspace_id, chunk)
+        result["synced_count"] += synced_count
+        result["error_count"] += error_count
+        ctx.checkpoint(start + len(chunk), result)
+    
+    result["message"] = f"同步完成：成功 {result['synced_count']} 條，失敗 {result['error_count']} 條"
+    return result
+
+@job_runner.handler("export")
+def run_export_job(ctx: jobs.JobContext):
+    """產生 Excel 並存為工作的下載檔案（查詢使用讀取副本）"""
+    download_data = [BarcodeResponse(**item) for item in ctx.params["data"]]
+    read_db = ReadSessionLocal()
+    try:
+        content = build_barcodes_excel(read_db, ctx.job.workspace_id, download_data, progress=ctx.checkpoint)
+    finally:
+        read_db.close()
+    
+    ctx.set_artifact(
+        content,
+        f"barcodes_data_{len(download_data)}.xlsx",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+    return {"rows": len(download_data), "size": len(content)}
+
+def job_to_response(job: Job) -> JobResponse:
+    return JobResponse(
+        id=job.id,
+        job_type=job.job_type,
+        status=job.status,
+        processed=job.processed or 0,
+        total=job.total or 0,
+        progress=round((job.processed or 0) / job.total, 4) if job.total else (1.0 if job.status == jobs.STATUS_SUCCEEDED else 0.0),
+        result=json.loads(job.result) if job.result else None,
+        error=job.error,
+        has_artifact=job.artifact_name is not None,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at
+    )
+
+def submit_job(db: Session, job_type: str, params: dict, workspace_id: int, total: int):
+    """建立工作，排隊已滿時回應 503"""
+    try:
+        job = job_runner.submit(db, job_type, params, workspace_id=workspace_id, total=total)
+    except jobs.QueueFull:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "背景工作已滿，請稍候再試"},
+            headers={"Retry-After": "30"}
+        )
+    return JSONResponse(status_code=202, content=jsonable_encoder(job_to_response(job)))
+
+def get_job_or_404(job_id: str, db: Session) -> Job:
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="工作不存在")
+    return job
+
+@app.post("/api/jobs/upload", response_model=JobResponse, status_code=202)
+def create_upload_job(barcodes_data: BarcodesBulkCreate, db: Session = Depends(get_db), workspace_id: int = Depends(get_workspace_id)):
+    """建立批量上傳工作"""
+    codes = clean_codes(barcodes_data.codes)
+    if not codes:
+        raise HTTPException(status_code=400, detail="沒有提供條碼")
+    
+    params = {
+        "codes": codes,
+        "batch_id": str(uuid.uuid4())[:8],
+        "upload_time": get_taipei_time().isoformat()
+    }
+    return submit_job(db, "upload", params, workspace_id, len(codes))
+
+@app.post("/api/jobs/offline-sync", response_model=JobResponse, status_code=202)
+def create_offline_sync_job(sync_request: OfflineSyncRequest, db: Session = Depends(get_db), workspace_id: int = Depends(get_workspace_id)):
+    """建立離線記錄同步工作"""
+    if not sync_request.records:
+        raise HTTPException(status_code=400, detail="沒有需要同步的記錄")
+    
+    params = {"records": [record.model_dump() for record in sync_request.records]}
+    return submit_job(db, "offline_sync", params, workspace_id, len(sync_request.records))
+
+@app.post("/api/jobs/export", response_model=JobResponse, status_code=202)
+def create_export_job(data: DownloadExcelRequest, db: Session = Depends(get_db), workspace_id: int = Depends(get_workspace_id)):
+    """建立 Excel 匯出工作"""
+    if not data.data:
+        raise HTTPException(status_code=400, detail="沒有資料可下載")
+    
+    params = {"data": [item.model_dump(mode="json") for item in data.data]}
+    return submit_job(db, "export", params, workspace_id, len(data.data))
+
+@app.get("/api/jobs", response_model=List[JobResponse])
+def list_jobs(limit: int = 50, db: Session = Depends(get_db)):
+    """最近的背景工作"""
+    return [job_to_response(job) for job in db.query(Job).order_by(Job.created_at.desc()).limit(limit).all()]
+
+@app.get("/api/jobs/{job_id}", response_model=JobResponse)
+def get_job(job_id: str, db: Session = Depends(get_db)):
+    """查詢工作狀態與進度"""
+    return job_to_response(get_job_or_404(job_id, db))
+
+@app.post("/api/jobs/{job_id}/cancel", response_model=JobResponse)
+def cancel_job(job_id: str, db: Session = Depends(get_db)):
+    """取消工作（已提交的分段不會回復）"""
+    return job_to_response(job_runner.cancel(db, get_job_or_404(job_id, db)))
+
+@app.get("/api/jobs/{job_id}/download")
+def download_job_artifact(job_id: str, db: Session = Depends(get_db)):
+    """下載工作產出的檔案"""
+    job = get_job_or_404(job_id, db)
+    if job.status != jobs.STATUS_SUCCEEDED or job.artifact_name is None:
+        raise HTTPException(status_code=404, detail="工作尚未完成或沒有可下載的檔案")
+    
+    return Response(
+        content=job.artifact,
+        media_type=job.artifact_type,
+        headers={
+            "Content-Disposition": f"attachment; filename={job.artifact_name}"
+        }
+    )
+
+
+# 效能剖析結果（需設定 PROFILING_ENABLED=true）
+@app.get("/api/debug/profiles")
+def list_profiles():
+    """最近的剖析結果摘要"""
+    if not profiling.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="效能剖析未啟用")
+    return [
+        {key: value for key, value in summary.items() if key not in ("statements", "profile")}
+        for summary in reversed(profiling.recent_profiles.values())
+    ]
+
+@app.get("/api/debug/profiles/{profile_id}")
+def get_profile(profile_id: str):
+    """單一請求的查詢統計與呼叫剖析"""
+    if not profiling.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="效能剖析未啟用")
+    summary = profiling.recent_profiles.get(profile_id)
+    if not summary:
+        raise HTTPException(status_code=404, detail="找不到剖析結果")
+    return summary
+
+profiling.install(app)
+
+
 # 創建資料庫表格
 def create_tables():
     Base.metadata.create_all(bind=engine)
@@ -762,6 +1456,20 @@ def create_tables():
 @app.on_event("startup")
 def startup_event():
     create_tables()
+    # 確保目前的工作區及其分區存在
+    active_workspace_cache.set(load_active_workspace_id())
+    read_router.start()
+    # 重播上次未寫入資料庫的掃描記錄
+    if scan_history_log is not None:
+        scan_history_log.start()
+    job_runner.start()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    job_runner.shutdown()
+    read_router.shutdown()
+    if scan_history_log is not None:
+        scan_history_log.shutdown()
 
 if __name__ == "__main__":
     import uvicorn
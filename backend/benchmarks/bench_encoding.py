@@ -0,0 +1,83 @@
+"""
+回應編碼與壓縮的效能比較
+
+以 /api/barcodes 典型的 500 筆與 10,000 筆資料，比較各種格式與壓縮方式的
+傳輸位元組數與編碼耗時（不需要資料庫）：
+
+    cd backend && python benchmarks/bench_encoding.py
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+import compression  # noqa: E402
+import encoding  # noqa: E402
+
+ROW_COUNTS = [500, 10_000]
+REPEAT = 5
+
+
+def make_rows(count: int):
+    """產生與 BarcodeResponse 相同欄位的資料"""
+    random.seed(count)
+    base_time = datetime(2025, 1, 1, 8, 0, 0)
+    rows = []
+    for i in range(count):
+        upload_time = base_time + timedelta(seconds=random.randint(0, 86400 * 30))
+        scanned = random.random() < 0.7
+        rows.append({
+            "id": i + 1,
+            "code": f"TW{random.randint(10**11, 10**12 - 1)}",
+            "upload_time": upload_time,
+            "scan_count": random.randint(1, 3) if scanned else 0,
+            "last_scan_time": upload_time + timedelta(hours=random.randint(1, 48)) if scanned else None,
+            "total_upload_count": random.randint(1, 2),
+            "first_upload_time": upload_time,
+        })
+    return jsonable_encoder(rows)
+
+
+def timed(func, *args):
+    """回傳 (結果, 平均毫秒)"""
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        result = func(*args)
+    return result, (time.perf_counter() - start) / REPEAT * 1000
+
+
+def main():
+    media_types = encoding.SUPPORTED_MEDIA_TYPES
+    encoders = [("identity", None)] + compression.ENCODERS
+
+    print(f"{'rows':>6}  {'format':<30} {'encoding':<9} {'bytes':>10} {'ratio':>6} {'encode ms':>10} {'compress ms':>12}")
+    for count in ROW_COUNTS:
+        rows = make_rows(count)
+        baseline = None
+        for media_type in media_types:
+            body, encode_ms = timed(encoding.encode_rows, rows, media_type)
+            for name, encoder in encoders:
+                if encoder is None:
+                    payload, compress_ms = body, 0.0
+                else:
+                    payload, compress_ms = timed(encoder, body)
+                if baseline is None:
+                    baseline = len(payload)
+                print(
+                    f"{count:>6}  {media_type:<30} {name:<9} {len(payload):>10} "
+                    f"{len(payload) / baseline:>6.2f} {encode_ms:>10.2f} {compress_ms:>12.2f}"
+                )
+        print()
+
+    missing = [name for name, module in (("msgpack", encoding.msgpack), ("brotli", compression.brotli), ("zstandard", compression.zstandard)) if module is None]
+    if missing:
+        print(f"未安裝的選用套件（略過）: {', '.join(missing)}")
+
+
+if __name__ == "__main__":
+    main()
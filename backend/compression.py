@@ -0,0 +1,173 @@
+"""
+回應壓縮中間件
+
+依 Accept-Encoding 協商壓縮格式：zstd、br（需安裝 zstandard / brotli）與 gzip，
+只壓縮超過 COMPRESSION_MIN_SIZE 位元組且屬於文字類的回應（Excel 本身已是 zip 格式）。
+超過 COMPRESSION_THREAD_MIN_SIZE 的回應在執行緒中壓縮，避免阻塞事件迴圈。
+"""
+import gzip
+import os
+
+import anyio
+
+try:
+    import brotli
+except ImportError:  # 選用套件
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # 選用套件
+    zstandard = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_THREAD_MIN_SIZE = int(os.getenv("COMPRESSION_THREAD_MIN_SIZE", str(64 * 1024)))
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "5"))
+ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+
+COMPRESSIBLE_TYPES = ("application/json", "application/msgpack", "application/vnd.columnar+json", "text/")
+
+
+def _compress_gzip(body: bytes) -> bytes:
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def _compress_brotli(body: bytes) -> bytes:
+    return brotli.compress(body, quality=BROTLI_QUALITY)
+
+
+def _compress_zstd(body: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+
+
+# 依伺服器偏好排序
+ENCODERS = [
+    (name, encoder)
+    for name, encoder, available in (
+        ("zstd", _compress_zstd, zstandard is not None),
+        ("br", _compress_brotli, brotli is not None),
+        ("gzip", _compress_gzip, True),
+    )
+    if available
+]
+
+
+def parse_accept_encoding(header: str) -> dict:
+    """解析 Accept-Encoding，回傳 {編碼: q 值}"""
+    accepted = {}
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token.strip().lower()] = q
+    return accepted
+
+
+def choose_encoding(header: str):
+    """選擇用戶端接受且 q 值最高的編碼（同分時依伺服器偏好）"""
+    accepted = parse_accept_encoding(header)
+    best = None
+    best_q = 0.0
+    for name, encoder in ENCODERS:
+        q = accepted.get(name, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = (name, encoder), q
+    return best
+
+
+class CompressionMiddleware:
+    """ASGI 中間件
+
+    依回應標頭判斷是否需要壓縮；需要壓縮的回應會緩衝到結束後一次壓縮
+    （本服務的回應都已在記憶體中產生，經過 BaseHTTPMiddleware 後才被切成多段）。
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE,
+                 thread_min_size: int = COMPRESSION_THREAD_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.thread_min_size = thread_min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        chosen = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if chosen is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        body_parts = []
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                passthrough = not self._is_compressible(message)
+                if passthrough:
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body_parts.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                await self._send_compressed(send, start_message, b"".join(body_parts), chosen)
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _is_compressible(start_message) -> bool:
+        content_type = ""
+        for key, value in start_message.get("headers", []):
+            key = key.lower()
+            if key == b"content-encoding":
+                return False
+            if key == b"content-type":
+                content_type = value.decode("latin-1")
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    @staticmethod
+    def _with_vary(headers, drop=()) -> list:
+        """加上 Vary: Accept-Encoding（保留原有的 Vary 值）"""
+        response_headers = [(k, v) for k, v in headers if k.lower() not in (b"vary",) + drop]
+        vary = [v for k, v in headers if k.lower() == b"vary"]
+        if vary and b"accept-encoding" not in vary[0].lower():
+            vary_value = vary[0] + b", Accept-Encoding"
+        else:
+            vary_value = vary[0] if vary else b"Accept-Encoding"
+        return response_headers + [(b"vary", vary_value)]
+
+    async def _send_compressed(self, send, start_message, body: bytes, chosen):
+        headers = start_message.get("headers", [])
+        if len(body) < self.minimum_size:
+            # 同一個網址的較大回應會被壓縮，快取需依 Accept-Encoding 區分
+            await send({**start_message, "headers": self._with_vary(headers)})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        name, encoder = chosen
+        if len(body) >= self.thread_min_size:
+            compressed = await anyio.to_thread.run_sync(encoder, body)
+        else:
+            compressed = encoder(body)
+        response_headers = self._with_vary(headers, drop=(b"content-length",)) + [
+            (b"content-encoding", name.encode()),
+            (b"content-length", str(len(compressed)).encode()),
+        ]
+
+        await send({**start_message, "headers": response_headers})
+        await send({"type": "http.response.body", "body": compressed})
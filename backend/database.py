@@ -5,6 +5,7 @@ import os
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from app import Base, DATABASE_URL
+import rollups
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from dotenv import load_dotenv
@@ -53,6 +54,98 @@ def create_database_if_not_exists():
     
     return True
 
+# 與 init.sql 相同的觸發器函數（依工作區更新條碼主表）
+UPDATE_BARCODE_MASTER_STATS_SQL = """
+CREATE OR REPLACE FUNCTION update_barcode_master_stats()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO barcodes_master (
+        workspace_id, code, total_upload_count, first_upload_time, last_upload_time, updated_at
+    ) VALUES (
+        NEW.workspace_id, NEW.code, 1, NEW.upload_time, NEW.upload_time, CURRENT_TIMESTAMP
+    )
+    ON CONFLICT (workspace_id, code) DO UPDATE SET
+        total_upload_count = barcodes_master.total_upload_count + 1,
+        last_upload_time = GREATEST(barcodes_master.last_upload_time, NEW.upload_time),
+        first_upload_time = LEAST(barcodes_master.first_upload_time, NEW.upload_time),
+        updated_at = CURRENT_TIMESTAMP;
+    
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+def migrate_workspaces(engine):
+    """舊版資料表升級：加入 workspace_id 欄位，既有資料歸入第一個工作區
+    
+    舊表不會轉為分區表（需要重建資料），仍可切換工作區，但刪除工作區會使用 DELETE。
+    """
+    with engine.begin() as conn:
+        legacy_tables = [
+            row[0] for row in conn.execute(text("""
+                SELECT t.table_name FROM information_schema.tables t
+                WHERE t.table_schema = current_schema()
+                  AND t.table_name IN ('upload_records', 'barcodes_master', 'scan_history')
+                  AND NOT EXISTS (
+                      SELECT 1 FROM information_schema.columns c
+                      WHERE c.table_schema = t.table_schema
+                        AND c.table_name = t.table_name
+                        AND c.column_name = 'workspace_id'
+                  )
+            """))
+        ]
+        if not legacy_tables:
+            return
+        
+        # 建立預設工作區
+        workspace_id = conn.execute(text(
+            "SELECT id FROM workspaces WHERE status = 'active' ORDER BY id DESC LIMIT 1"
+        )).scalar()
+        if workspace_id is None:
+            workspace_id = conn.execute(text(
+                "INSERT INTO workspaces (name, status, created_at) VALUES ('default', 'active', CURRENT_TIMESTAMP) RETURNING id"
+            )).scalar()
+        
+        for table in legacy_tables:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN workspace_id INTEGER NOT NULL DEFAULT {int(workspace_id)}"))
+            conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN workspace_id DROP DEFAULT"))
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_workspace_id ON {table}(workspace_id)"))
+            print(f"資料表 {table} 已加入 workspace_id 欄位")
+        
+        if "barcodes_master" in legacy_tables:
+            # 條碼唯一性改為同一工作區內唯一
+            conn.execute(text("ALTER TABLE barcodes_master DROP CONSTRAINT IF EXISTS barcodes_master_code_key"))
+            conn.execute(text("DROP INDEX IF EXISTS ix_barcodes_master_code"))
+            conn.execute(text("CREATE INDEX ix_barcodes_master_code ON barcodes_master(code)"))
+            conn.execute(text(
+                "ALTER TABLE barcodes_master ADD CONSTRAINT uq_barcodes_master_workspace_code UNIQUE (workspace_id, code)"
+            ))
+        
+        conn.execute(text(UPDATE_BARCODE_MASTER_STATS_SQL))
+
+def migrate_scan_event_id(engine):
+    """舊版 scan_history 加入 event_id 欄位與唯一索引（掃描記錄延遲寫入重播時去重）"""
+    with engine.begin() as conn:
+        has_column = conn.execute(text("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema()
+              AND table_name = 'scan_history'
+              AND column_name = 'event_id'
+        """)).first()
+        if has_column:
+            return
+        conn.execute(text("ALTER TABLE scan_history ADD COLUMN event_id VARCHAR(32)"))
+        conn.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_scan_history_workspace_event ON scan_history (workspace_id, event_id)"
+        ))
+        print("資料表 scan_history 已加入 event_id 欄位")
+
+def migrate_job_lease(engine):
+    """舊版 jobs 表加入租約欄位"""
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS owner VARCHAR(100)"))
+        conn.execute(text("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP"))
+
 def init_database():
     """初始化資料庫表格"""
     try:
@@ -63,6 +156,15 @@ def init_database():
         Base.metadata.create_all(bind=engine)
         print("資料庫表格創建成功")
         
+        migrate_workspaces(engine)
+        migrate_scan_event_id(engine)
+        migrate_job_lease(engine)
+        
+        # 第一次建立彙總表時，由既有的原始資料重建
+        with engine.begin() as conn:
+            if rollups.rebuild_if_empty(conn):
+                print("統計彙總表重建完成")
+        
         return True
         
     except Exception as e:
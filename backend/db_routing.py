@@ -0,0 +1,165 @@
+"""
+讀寫分離：唯讀端點使用讀取副本（read replica）
+
+設定 DATABASE_READ_URL（可用逗號分隔多個）後，唯讀端點會輪流使用健康的副本；
+副本無法連線或複寫延遲超過 DATABASE_READ_MAX_LAG 秒時自動退回主資料庫。
+未設定時所有請求都使用主資料庫。
+
+副本狀態由背景執行緒每 DATABASE_READ_CHECK_INTERVAL 秒檢查一次，請求只讀取檢查結果；
+查詢途中副本斷線時，ReadSession 會改用主資料庫重試一次。
+"""
+import os
+import threading
+import time
+from itertools import count
+from typing import List, Optional
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.orm import Session
+
+# 副本複寫延遲（秒）；非副本（例如本機第二個 PostgreSQL）回傳 0
+REPLICA_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+class ReadReplica:
+    """單一讀取副本與其健康狀態"""
+
+    def __init__(self, url: str, connect_timeout: int):
+        self.url = url
+        self.engine = create_engine(
+            url,
+            pool_pre_ping=True,
+            connect_args={"connect_timeout": connect_timeout},
+        )
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.error: Optional[str] = None
+        self.checked_at = 0.0
+
+        # 查詢時發生斷線，立即標記為不健康，下一個請求改走主資料庫
+        event.listen(self.engine, "handle_error", self._on_error)
+
+    def _on_error(self, context):
+        if context.is_disconnect:
+            self.mark_down(context.original_exception)
+
+    def mark_down(self, error):
+        """標記為不健康，直到下一次背景檢查通過"""
+        self.healthy = False
+        self.error = str(error)
+        self.checked_at = time.monotonic()
+
+    def check(self, max_lag: float):
+        """檢查連線與複寫延遲"""
+        try:
+            with self.engine.connect() as conn:
+                self.lag = float(conn.execute(text(REPLICA_LAG_SQL)).scalar() or 0)
+            self.healthy = self.lag <= max_lag
+            self.error = None if self.healthy else f"複寫延遲 {self.lag:.1f} 秒"
+        except Exception as e:
+            self.healthy = False
+            self.lag = None
+            self.error = str(e)
+        self.checked_at = time.monotonic()
+
+
+class ReadReplicaRouter:
+    """依副本狀態選擇唯讀查詢使用的引擎"""
+
+    def __init__(self, primary: Engine, read_urls: List[str], max_lag: float, check_interval: float, connect_timeout: int = 2):
+        self.primary = primary
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.replicas = [ReadReplica(url, connect_timeout) for url in read_urls]
+        self._counter = count()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls, primary: Engine):
+        read_urls = [url.strip() for url in os.getenv("DATABASE_READ_URL", "").split(",") if url.strip()]
+        return cls(
+            primary,
+            read_urls,
+            max_lag=float(os.getenv("DATABASE_READ_MAX_LAG", "10")),
+            check_interval=float(os.getenv("DATABASE_READ_CHECK_INTERVAL", "5")),
+            connect_timeout=int(os.getenv("DATABASE_READ_CONNECT_TIMEOUT", "2")),
+        )
+
+    def start(self):
+        """啟動背景健康檢查（第一次檢查完成前唯讀查詢使用主資料庫）"""
+        if not self.replicas or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._check_loop, name="read-replica-check", daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        self._stop.set()
+        self._thread = None
+
+    def _check_loop(self):
+        while not self._stop.is_set():
+            for replica in self.replicas:
+                replica.check(self.max_lag)
+            self._stop.wait(self.check_interval)
+
+    def get_engine(self) -> Engine:
+        """輪流選擇可用的副本，全部不可用時使用主資料庫"""
+        if not self.replicas:
+            return self.primary
+        start = next(self._counter)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if replica.healthy:
+                return replica.engine
+        return self.primary
+
+    def mark_down(self, engine: Engine, error):
+        for replica in self.replicas:
+            if replica.engine is engine:
+                replica.mark_down(error)
+
+    def status(self) -> dict:
+        return {
+            "max_lag": self.max_lag,
+            "replicas": [
+                {
+                    "url": replica.engine.url.render_as_string(hide_password=True),
+                    "healthy": replica.healthy,
+                    "lag": replica.lag,
+                    "error": replica.error,
+                }
+                for replica in self.replicas
+            ],
+        }
+
+
+class ReadSession(Session):
+    """唯讀查詢使用的 Session：綁定 router 選出的引擎，副本斷線時改用主資料庫重試一次"""
+
+    def __init__(self, *args, router: ReadReplicaRouter, **kwargs):
+        if kwargs.get("bind") is None:
+            kwargs["bind"] = router.get_engine()
+        super().__init__(*args, **kwargs)
+        self.router = router
+
+    def execute(self, *args, **kwargs):
+        try:
+            return super().execute(*args, **kwargs)
+        except DBAPIError as e:
+            if self.bind is self.router.primary or not (e.connection_invalidated or isinstance(e, OperationalError)):
+                raise
+            print(f"讀取副本查詢失敗，改用主資料庫: {e.orig}")
+            self.router.mark_down(self.bind, e.orig)
+            self.rollback()
+            self.bind = self.router.primary
+            return super().execute(*args, **kwargs)
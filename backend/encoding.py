@@ -0,0 +1,78 @@
+"""
+大量資料端點的回應編碼
+
+依 Accept 標頭選擇：
+- application/json（預設，與原本格式相同）
+- application/vnd.columnar+json：欄位式 JSON，欄位名稱只出現一次
+  {"columns": [...], "rows": N, "data": {"欄位": [值, ...]}}
+- application/msgpack：MessagePack（需安裝 msgpack），內容與 JSON 相同
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+try:
+    import msgpack
+except ImportError:  # 選用套件
+    msgpack = None
+
+JSON_MEDIA_TYPE = "application/json"
+COLUMNAR_MEDIA_TYPE = "application/vnd.columnar+json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+SUPPORTED_MEDIA_TYPES = [JSON_MEDIA_TYPE, COLUMNAR_MEDIA_TYPE] + ([MSGPACK_MEDIA_TYPE] if msgpack else [])
+
+
+def choose_media_type(accept: Optional[str]) -> str:
+    """選擇 q 值最高且支援的格式，無法判斷時使用 JSON"""
+    if not accept:
+        return JSON_MEDIA_TYPE
+    best = JSON_MEDIA_TYPE
+    best_q = 0.0
+    for part in accept.split(","):
+        media_type, _, params = part.strip().partition(";")
+        media_type = media_type.strip().lower()
+        if media_type == "application/x-msgpack":
+            media_type = MSGPACK_MEDIA_TYPE
+        if media_type not in SUPPORTED_MEDIA_TYPES:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        # 同分時優先使用較精簡的格式（例如 Accept: application/msgpack, application/json）
+        if q > best_q or (q == best_q and q > 0 and best == JSON_MEDIA_TYPE):
+            best, best_q = media_type, q
+    return best
+
+
+def to_columnar(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """列式資料轉為欄位式"""
+    columns = list(rows[0].keys()) if rows else []
+    return {
+        "columns": columns,
+        "rows": len(rows),
+        "data": {column: [row.get(column) for row in rows] for column in columns},
+    }
+
+
+def encode_rows(rows: List[Dict[str, Any]], media_type: str) -> bytes:
+    """將已轉為 JSON 相容型別的資料編碼"""
+    if media_type == COLUMNAR_MEDIA_TYPE:
+        return json.dumps(to_columnar(rows), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.packb(rows, use_bin_type=True)
+    return json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encoded_response(request: Request, rows: List[Any]) -> Response:
+    """依 Accept 標頭編碼列表資料（Pydantic 模型或 dict）"""
+    media_type = choose_media_type(request.headers.get("accept"))
+    body = encode_rows(jsonable_encoder(rows), media_type)
+    return Response(content=body, media_type=media_type, headers={"Vary": "Accept"})
@@ -0,0 +1,267 @@
+"""
+背景工作（Job）執行器
+
+大量上傳、匯出與離線同步改為建立工作後立即回應，由程序內的有限執行緒池處理：
+
+- 工作狀態存放在資料庫的 jobs 表，重新啟動後未完成的工作會繼續執行
+- 處理函式以分段（chunk）方式提交，進度與資料在同一個交易內寫入，因此可從中斷處續跑
+- 每個分段提交時檢查是否已要求取消
+- 執行中的工作由取得租約（lease）的程序負責，每個分段提交時更新 heartbeat_at；
+  只有租約逾時（程序已中斷）的工作才會被其他程序或重新啟動後的程序重新排入，
+  分段提交也只在仍持有租約時才會成功，避免同一個工作被執行兩次
+- 程序正常結束（重新部署、--reload）時，執行中的工作在下一個分段提交後停止並改回 queued，
+  下一個程序啟動時立即接手，不需等待租約逾時
+"""
+import json
+import os
+import socket
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+# 工作狀態
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+FINISHED_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELLED)
+
+JOBS_MAX_WORKERS = int(os.getenv("JOBS_MAX_WORKERS", "2"))
+JOBS_MAX_PENDING = int(os.getenv("JOBS_MAX_PENDING", "20"))  # 排隊中的工作上限
+JOBS_CHUNK_SIZE = int(os.getenv("JOBS_CHUNK_SIZE", "1000"))  # 每次提交處理的筆數
+JOBS_LEASE_TIMEOUT = int(os.getenv("JOBS_LEASE_TIMEOUT", "300"))  # 秒，超過此時間未更新 heartbeat 視為程序已中斷
+
+
+class JobCancelled(Exception):
+    """工作已被要求取消"""
+
+
+class QueueFull(Exception):
+    """排隊中的工作已達上限"""
+
+
+class LeaseLost(Exception):
+    """租約已逾時並被其他程序接手"""
+
+
+class JobInterrupted(Exception):
+    """程序正在結束，工作需交由下一個程序繼續"""
+
+
+class JobContext:
+    """傳給處理函式的執行環境"""
+
+    def __init__(self, runner: "JobRunner", db: Session, job):
+        self.runner = runner
+        self.db = db
+        self.job = job
+        self.params = json.loads(job.params) if job.params else {}
+
+    @property
+    def processed(self) -> int:
+        """已提交的筆數，續跑時從這裡開始"""
+        return self.job.processed or 0
+
+    def checkpoint(self, processed: int, result: Optional[dict] = None):
+        """提交目前的分段與進度（同時更新 heartbeat），並檢查是否已要求取消"""
+        Job = self.runner.job_model
+        values = {"processed": processed, "heartbeat_at": func.now()}
+        if result is not None:
+            values["result"] = json.dumps(result, ensure_ascii=False)
+        # 只在仍持有租約時提交，分段資料與進度在同一個交易內
+        owned = self.db.query(Job).filter(
+            Job.id == self.job.id,
+            Job.owner == self.runner.owner,
+            Job.status == STATUS_RUNNING
+        ).update(values, synchronize_session=False)
+        if not owned:
+            self.db.rollback()
+            raise LeaseLost()
+        self.db.commit()
+
+        self.db.refresh(self.job, attribute_names=["processed", "result", "cancel_requested"])
+        if self.job.cancel_requested:
+            raise JobCancelled()
+        if self.runner.stopping:
+            raise JobInterrupted()
+
+    def set_artifact(self, content: bytes, filename: str, media_type: str):
+        self.job.artifact = content
+        self.job.artifact_name = filename
+        self.job.artifact_type = media_type
+
+
+class JobRunner:
+    """以 ThreadPoolExecutor 執行資料庫中的工作"""
+
+    def __init__(self, session_factory, job_model, now: Callable, max_workers: int = JOBS_MAX_WORKERS):
+        self.session_factory = session_factory
+        self.job_model = job_model
+        self.now = now
+        self.max_workers = max_workers
+        self.handlers: Dict[str, Callable[[JobContext], Optional[dict]]] = {}
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stop = threading.Event()
+
+    def handler(self, job_type: str):
+        """註冊工作處理函式（裝飾器）"""
+        def decorator(func):
+            self.handlers[job_type] = func
+            return func
+        return decorator
+
+    def start(self):
+        """啟動執行緒池，排入尚未開始的工作與租約逾時的工作"""
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+        self._stop.clear()
+        self._requeue_expired()
+        db = self.session_factory()
+        try:
+            Job = self.job_model
+            pending = db.query(Job.id).filter(Job.status == STATUS_QUEUED).order_by(Job.created_at).all()
+        finally:
+            db.close()
+        for (job_id,) in pending:
+            self._executor.submit(self._run, job_id)
+        threading.Thread(target=self._reap_loop, name="job-lease", daemon=True).start()
+
+    @property
+    def stopping(self) -> bool:
+        return self._stop.is_set()
+
+    def shutdown(self):
+        """停止接受工作；執行中的工作會在下一個分段提交後交還（見 JobInterrupted）"""
+        self._stop.set()
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _requeue_expired(self):
+        """將租約逾時的執行中工作改回 queued 並排入本程序"""
+        Job = self.job_model
+        expired = or_(
+            Job.heartbeat_at.is_(None),
+            Job.heartbeat_at < func.now() - timedelta(seconds=JOBS_LEASE_TIMEOUT)
+        )
+        db = self.session_factory()
+        try:
+            job_ids = [job_id for (job_id,) in db.query(Job.id).filter(Job.status == STATUS_RUNNING, expired)]
+            if not job_ids:
+                return
+            requeued = [
+                job_id for (job_id,) in db.execute(
+                    Job.__table__.update()
+                    .where(Job.id.in_(job_ids), Job.status == STATUS_RUNNING, expired)
+                    .values(status=STATUS_QUEUED, owner=None)
+                    .returning(Job.id)
+                )
+            ]
+            db.commit()
+        finally:
+            db.close()
+        for job_id in requeued:
+            print(f"背景工作 {job_id} 的租約已逾時，重新排入")
+            self._executor.submit(self._run, job_id)
+
+    def _reap_loop(self):
+        """定期接手其他程序中斷後留下的工作"""
+        while not self._stop.wait(JOBS_LEASE_TIMEOUT / 2):
+            try:
+                self._requeue_expired()
+            except Exception as e:
+                print(f"檢查背景工作租約失敗: {e}")
+
+    def submit(self, db: Session, job_type: str, params: dict, workspace_id: Optional[int] = None, total: int = 0):
+        """建立工作並排入執行緒池"""
+        Job = self.job_model
+        pending_count = db.query(Job).filter(Job.status.in_([STATUS_QUEUED, STATUS_RUNNING])).count()
+        if pending_count >= JOBS_MAX_PENDING:
+            raise QueueFull()
+
+        job = Job(
+            id=uuid.uuid4().hex,
+            job_type=job_type,
+            status=STATUS_QUEUED,
+            workspace_id=workspace_id,
+            params=json.dumps(params, ensure_ascii=False, default=str),
+            processed=0,
+            total=total,
+            cancel_requested=False,
+            created_at=self.now(),
+        )
+        db.add(job)
+        db.commit()
+        self._executor.submit(self._run, job.id)
+        return job
+
+    def cancel(self, db: Session, job):
+        """要求取消；尚未開始的工作直接標記為已取消"""
+        if job.status in FINISHED_STATUSES:
+            return job
+        job.cancel_requested = True
+        if job.status == STATUS_QUEUED:
+            job.status = STATUS_CANCELLED
+            job.finished_at = self.now()
+        db.commit()
+        return job
+
+    def _claim(self, db: Session, job_id: str):
+        """將工作由 queued 改為 running，避免重複執行"""
+        Job = self.job_model
+        claimed = db.query(Job).filter(Job.id == job_id, Job.status == STATUS_QUEUED).update(
+            {"status": STATUS_RUNNING, "started_at": self.now(), "owner": self.owner, "heartbeat_at": func.now()},
+            synchronize_session=False
+        )
+        db.commit()
+        if not claimed:
+            return None
+        return db.query(Job).filter(Job.id == job_id).first()
+
+    def _run(self, job_id: str):
+        db = self.session_factory()
+        try:
+            job = self._claim(db, job_id)
+            if job is None:
+                return
+            try:
+                handler = self.handlers[job.job_type]
+                result = handler(JobContext(self, db, job))
+                if result is not None:
+                    job.result = json.dumps(result, ensure_ascii=False)
+                job.status = STATUS_SUCCEEDED
+            except LeaseLost:
+                db.rollback()
+                print(f"背景工作 {job_id} 已由其他程序接手")
+                return
+            except JobInterrupted:
+                # 已提交的分段保留，改回 queued 讓下一個程序從 processed 繼續
+                db.rollback()
+                Job = self.job_model
+                db.query(Job).filter(Job.id == job_id, Job.owner == self.owner).update(
+                    {"status": STATUS_QUEUED, "owner": None}, synchronize_session=False
+                )
+                db.commit()
+                print(f"背景工作 {job_id} 因程序結束而中斷，已重新排入")
+                return
+            except JobCancelled:
+                db.rollback()
+                job.status = STATUS_CANCELLED
+            except Exception as e:
+                db.rollback()
+                traceback.print_exc()
+                job.status = STATUS_FAILED
+                job.error = str(e)[:1000]
+            job.finished_at = self.now()
+            db.commit()
+        except Exception as e:
+            print(f"背景工作 {job_id} 執行失敗: {e}")
+        finally:
+            db.close()
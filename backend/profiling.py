@@ -0,0 +1,209 @@
+"""
+請求層級的效能分析與 SQL 查詢追蹤
+
+- 每個請求透過 SQLAlchemy 引擎事件計算查詢數量與耗時，
+  超過 QUERY_COUNT_WARN_THRESHOLD 時輸出警告並列出重複最多的查詢（N+1）
+- PROFILING_ENABLED=true 時，帶有 `X-Profile: 1` 標頭或依 PROFILING_SAMPLE_RATE 抽樣的請求
+  會以 cProfile 記錄端點的呼叫剖析，結果寫入 PROFILING_OUTPUT_DIR，並可由除錯端點查詢
+"""
+import asyncio
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import random
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import Request
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROFILE_HEADER = "x-profile"
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_OUTPUT_DIR = os.getenv("PROFILING_OUTPUT_DIR", "profiles")
+PROFILING_KEEP = int(os.getenv("PROFILING_KEEP", "50"))  # 記憶體中保留的結果數量
+QUERY_TRACE_ENABLED = os.getenv("QUERY_TRACE_ENABLED", "true").lower() == "true"
+QUERY_COUNT_WARN_THRESHOLD = int(os.getenv("QUERY_COUNT_WARN_THRESHOLD", "50"))
+
+# 目前請求的追蹤資料（會隨 contextvars 傳遞到 threadpool）
+_current_trace: contextvars.ContextVar[Optional["RequestTrace"]] = contextvars.ContextVar("request_trace", default=None)
+
+# 最近的剖析結果
+recent_profiles: "OrderedDict[str, dict]" = OrderedDict()
+
+
+class RequestTrace:
+    """單一請求的查詢統計與剖析器"""
+
+    def __init__(self, method: str, path: str, profile: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.query_count = 0
+        self.query_time = 0.0
+        self.statements = {}  # SQL -> [次數, 總耗時]
+        self.profiler = cProfile.Profile() if profile else None
+
+    def record_query(self, statement: str, duration: float):
+        self.query_count += 1
+        self.query_time += duration
+        stats = self.statements.setdefault(statement, [0, 0.0])
+        stats[0] += 1
+        stats[1] += duration
+
+    def top_statements(self, limit: int = 10):
+        """依次數排序的查詢"""
+        ordered = sorted(self.statements.items(), key=lambda item: (item[1][0], item[1][1]), reverse=True)
+        return [
+            {"sql": sql[:500], "count": count, "total_time": round(total, 4)}
+            for sql, (count, total) in ordered[:limit]
+        ]
+
+    def profile_text(self, limit: int = 40) -> str:
+        output = io.StringIO()
+        pstats.Stats(self.profiler, stream=output).sort_stats("cumulative").print_stats(limit)
+        return output.getvalue()
+
+    def summary(self, status_code: int, elapsed: float) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": status_code,
+            "started_at": self.started_at,
+            "elapsed": round(elapsed, 4),
+            "query_count": self.query_count,
+            "query_time": round(self.query_time, 4),
+            "statements": self.top_statements(),
+        }
+
+
+# ---- SQLAlchemy 事件：套用到所有引擎（含讀取副本） ----
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_trace.get() is not None:
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    start_times = conn.info.get("query_start_time")
+    if start_times:
+        trace.record_query(statement, time.perf_counter() - start_times.pop())
+
+
+# ---- 端點剖析 ----
+
+def _wrap_endpoint(call):
+    """在實際執行端點的執行緒中啟用 cProfile（同步端點在 threadpool 執行）"""
+    if getattr(call, "__profiled__", False):
+        return call
+
+    if asyncio.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def async_wrapper(*args, **kwargs):
+            trace = _current_trace.get()
+            if trace is None or trace.profiler is None:
+                return await call(*args, **kwargs)
+            trace.profiler.enable()
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                trace.profiler.disable()
+        async_wrapper.__profiled__ = True
+        return async_wrapper
+
+    @functools.wraps(call)
+    def wrapper(*args, **kwargs):
+        trace = _current_trace.get()
+        if trace is None or trace.profiler is None:
+            return call(*args, **kwargs)
+        trace.profiler.enable()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            trace.profiler.disable()
+    wrapper.__profiled__ = True
+    return wrapper
+
+
+def install(app):
+    """包裝所有路由的端點函式，需在所有路由註冊後呼叫"""
+    if not PROFILING_ENABLED:
+        return
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            route.dependant.call = _wrap_endpoint(route.dependant.call)
+
+
+def should_profile(request: Request) -> bool:
+    if not PROFILING_ENABLED:
+        return False
+    if request.headers.get(PROFILE_HEADER, "").lower() in ("1", "true"):
+        return True
+    return PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE
+
+
+def _save_profile(trace: RequestTrace, summary: dict):
+    """寫入本機目錄並保留在記憶體中"""
+    summary["profile"] = trace.profile_text()
+    recent_profiles[trace.id] = summary
+    while len(recent_profiles) > PROFILING_KEEP:
+        recent_profiles.popitem(last=False)
+
+    try:
+        os.makedirs(PROFILING_OUTPUT_DIR, exist_ok=True)
+        base = os.path.join(PROFILING_OUTPUT_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_{trace.id}")
+        trace.profiler.dump_stats(base + ".prof")  # 可用 snakeviz / pstats 開啟
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        print(f"剖析結果寫入失敗: {e}")
+
+
+# ---- 中間件入口 ----
+
+async def handle(request: Request, call_next):
+    """在中間件中呼叫，追蹤查詢並視需要剖析"""
+    profile = should_profile(request)
+    if not (QUERY_TRACE_ENABLED or profile):
+        return await call_next(request)
+
+    trace = RequestTrace(request.method, request.url.path, profile)
+    token = _current_trace.set(trace)
+    start_time = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _current_trace.reset(token)
+    elapsed = time.perf_counter() - start_time
+
+    response.headers["X-Query-Count"] = str(trace.query_count)
+    response.headers["X-Query-Time"] = f"{trace.query_time:.4f}"
+
+    if trace.query_count > QUERY_COUNT_WARN_THRESHOLD:
+        top = trace.top_statements(1)
+        print(
+            f"⚠️ 查詢次數過多: {trace.method} {trace.path} 執行了 {trace.query_count} 次查詢 "
+            f"({trace.query_time:.3f}s / {elapsed:.3f}s)，最多重複: {top[0]['count']} 次 {top[0]['sql'][:200]}"
+        )
+
+    if trace.profiler is not None:
+        _save_profile(trace, trace.summary(response.status_code, elapsed))
+        response.headers["X-Profile-Id"] = trace.id
+
+    return response
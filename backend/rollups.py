@@ -0,0 +1,142 @@
+"""
+每小時統計彙總（rollup）
+
+寫入掃描記錄、離線同步與上傳記錄時，在同一個交易內累加小時統計，
+分析端點直接查詢彙總表，耗時與原始歷史資料量無關。
+
+每次掃描都會更新同一小時的統計列，為避免所有掃描搶同一列的鎖，
+每小時的統計分散在 ROLLUP_SHARDS 個分片列上，查詢時再加總。
+"""
+import os
+import random
+from datetime import datetime
+from typing import Dict, Iterable, Tuple
+
+import pytz
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+TAIPEI_TZ = pytz.timezone('Asia/Taipei')
+
+ROLLUP_SHARDS = int(os.getenv("ROLLUP_SHARDS", "8"))
+
+UPSERT_HOURLY_SQL = text("""
+INSERT INTO hourly_stats (workspace_id, bucket_start, shard, scan_total, scan_success, scan_error, upload_count)
+VALUES (:workspace_id, :bucket_start, :shard, :scan_total, :scan_success, :scan_error, :upload_count)
+ON CONFLICT (workspace_id, bucket_start, shard) DO UPDATE SET
+    scan_total = hourly_stats.scan_total + EXCLUDED.scan_total,
+    scan_success = hourly_stats.scan_success + EXCLUDED.scan_success,
+    scan_error = hourly_stats.scan_error + EXCLUDED.scan_error,
+    upload_count = hourly_stats.upload_count + EXCLUDED.upload_count
+""")
+
+UPSERT_BATCH_SQL = text("""
+INSERT INTO upload_batch_stats (workspace_id, batch_id, first_upload_time, code_count, new_count)
+VALUES (:workspace_id, :batch_id, :upload_time, :code_count, :new_count)
+ON CONFLICT (workspace_id, batch_id) DO UPDATE SET
+    first_upload_time = LEAST(upload_batch_stats.first_upload_time, EXCLUDED.first_upload_time),
+    code_count = upload_batch_stats.code_count + EXCLUDED.code_count,
+    new_count = upload_batch_stats.new_count + EXCLUDED.new_count
+""")
+
+# 由原始資料重建（升級後第一次啟動時使用）
+REBUILD_SQL = [
+    text("""
+    INSERT INTO hourly_stats (workspace_id, bucket_start, shard, scan_total, scan_success, scan_error, upload_count)
+    SELECT workspace_id, bucket_start, 0, SUM(scan_total), SUM(scan_success), SUM(scan_error), SUM(upload_count)
+    FROM (
+        SELECT workspace_id, date_trunc('hour', timestamp) AS bucket_start,
+               COUNT(*) AS scan_total,
+               COUNT(*) FILTER (WHERE result = 'success') AS scan_success,
+               COUNT(*) FILTER (WHERE result = 'error') AS scan_error,
+               0 AS upload_count
+        FROM scan_history GROUP BY 1, 2
+        UNION ALL
+        SELECT workspace_id, date_trunc('hour', upload_time), 0, 0, 0, COUNT(*)
+        FROM upload_records GROUP BY 1, 2
+    ) raw
+    GROUP BY workspace_id, bucket_start
+    """),
+    text("""
+    INSERT INTO upload_batch_stats (workspace_id, batch_id, first_upload_time, code_count, new_count)
+    SELECT workspace_id, upload_batch_id, MIN(upload_time), COUNT(*), NULL
+    FROM upload_records
+    WHERE upload_batch_id IS NOT NULL
+    GROUP BY workspace_id, upload_batch_id
+    """),
+]
+
+
+def to_local(timestamp: datetime) -> datetime:
+    """轉為無時區的台北時間（與資料表中的時間欄位一致）"""
+    if timestamp.tzinfo is not None:
+        return timestamp.astimezone(TAIPEI_TZ).replace(tzinfo=None)
+    return timestamp
+
+
+def hour_bucket(timestamp: datetime) -> datetime:
+    """取整到小時"""
+    return to_local(timestamp).replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(timestamp: datetime) -> datetime:
+    """取整到當日 00:00（台北時間）"""
+    return hour_bucket(timestamp).replace(hour=0)
+
+
+def add_hourly(db: Session, workspace_id: int, counts: Dict[datetime, Tuple[int, int, int, int]]):
+    """累加小時統計，counts 為 {小時: (掃描數, 成功數, 失敗數, 上傳數)}"""
+    if not counts:
+        return
+    shard = random.randrange(ROLLUP_SHARDS)
+    # 依時間排序寫入，避免多個交易以不同順序鎖定統計列而死結
+    db.execute(UPSERT_HOURLY_SQL, [
+        {
+            "workspace_id": workspace_id,
+            "bucket_start": bucket_start,
+            "shard": shard,
+            "scan_total": scan_total,
+            "scan_success": scan_success,
+            "scan_error": scan_error,
+            "upload_count": upload_count,
+        }
+        for bucket_start, (scan_total, scan_success, scan_error, upload_count) in sorted(counts.items())
+    ])
+
+
+def record_scans(db: Session, workspace_id: int, scans: Iterable[Tuple[datetime, str]]):
+    """累加掃描統計，scans 為 (時間, 結果) 的序列"""
+    counts = {}
+    for timestamp, result in scans:
+        bucket = hour_bucket(timestamp)
+        scan_total, scan_success, scan_error, upload_count = counts.get(bucket, (0, 0, 0, 0))
+        counts[bucket] = (
+            scan_total + 1,
+            scan_success + (result == 'success'),
+            scan_error + (result == 'error'),
+            upload_count,
+        )
+    add_hourly(db, workspace_id, counts)
+
+
+def record_upload(db: Session, workspace_id: int, batch_id: str, upload_time: datetime, code_count: int, new_count: int):
+    """累加上傳統計與批次統計"""
+    if not code_count:
+        return
+    add_hourly(db, workspace_id, {hour_bucket(upload_time): (0, 0, 0, code_count)})
+    db.execute(UPSERT_BATCH_SQL, {
+        "workspace_id": workspace_id,
+        "batch_id": batch_id,
+        "upload_time": to_local(upload_time),
+        "code_count": code_count,
+        "new_count": new_count,
+    })
+
+
+def rebuild_if_empty(conn) -> bool:
+    """彙總表為空但已有原始資料時，以 GROUP BY 重建一次"""
+    if conn.execute(text("SELECT 1 FROM hourly_stats LIMIT 1")).first() is not None:
+        return False
+    for statement in REBUILD_SQL:
+        conn.execute(statement)
+    return True
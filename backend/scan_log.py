@@ -0,0 +1,450 @@
+"""
+掃描記錄延遲寫入（write-behind）
+
+啟用 SCAN_WRITE_BEHIND 後，/api/scan 只有條碼主表計數（成功掃描）在請求內同步提交，
+掃描歷史（scan_history）先寫入本機的僅附加記錄檔，再由背景執行緒批次寫入資料庫：
+
+- 每筆記錄寫入後等待 fsync 才回應，多個請求共用同一次 fsync（group commit）
+- 記錄檔依區段（segment）輪替，背景執行緒將已關閉的區段以多列 INSERT 在單一交易內寫入，
+  同一個交易內依實際寫入的記錄累加小時統計，成功後刪除該區段
+- 每筆記錄帶有 event_id，以 ON CONFLICT DO NOTHING 寫入，
+  程序中斷後重新啟動會重播剩餘的區段，重複寫入不會產生重複資料或重複統計
+- 成功掃描的記錄在條碼主表計數提交前標記為待確認（pending），提交失敗時寫入
+  {"abort": event_id} 取消該筆記錄；區段內還有待確認的記錄時不會寫入資料庫
+
+程序在 fsync 完成後、計數提交（或取消記錄寫入）完成前中斷時，重播會留下一筆
+條碼主表沒有計數的成功掃描歷史；用戶端沒有收到回應，通常會再掃描一次。
+
+每個程序（例如 uvicorn --workers N）在 SCAN_LOG_DIR 下以檔案鎖取得自己的編號子目錄
+（SCAN_LOG_DIR/0、SCAN_LOG_DIR/1 ...）；程序結束後無人持有鎖的子目錄，
+由其他程序每 SCAN_LOG_ORPHAN_INTERVAL 秒檢查並代為寫入剩餘的區段。
+掃描歷史與統計查詢最多會落後 SCAN_LOG_FLUSH_INTERVAL 秒。
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+import rollups
+import workspaces
+
+SCAN_WRITE_BEHIND = os.getenv("SCAN_WRITE_BEHIND", "false").lower() == "true"
+SCAN_LOG_DIR = os.getenv("SCAN_LOG_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "scan_log"))
+SCAN_LOG_FSYNC_WINDOW = float(os.getenv("SCAN_LOG_FSYNC_WINDOW", "0.002"))  # 秒，收集同一次 fsync 的等待時間
+SCAN_LOG_FLUSH_INTERVAL = float(os.getenv("SCAN_LOG_FLUSH_INTERVAL", "0.5"))  # 秒
+SCAN_LOG_BATCH_SIZE = int(os.getenv("SCAN_LOG_BATCH_SIZE", "500"))  # 每個 INSERT 的筆數
+SCAN_LOG_ORPHAN_INTERVAL = float(os.getenv("SCAN_LOG_ORPHAN_INTERVAL", "30"))  # 秒
+
+SEGMENT_PREFIX = "scan-"
+SEGMENT_SUFFIX = ".log"
+LOCK_FILENAME = "scan-log.lock"
+
+
+def segment_name(seq: int) -> str:
+    return f"{SEGMENT_PREFIX}{seq:012d}{SEGMENT_SUFFIX}"
+
+
+def segment_seq(filename: str) -> Optional[int]:
+    if not (filename.startswith(SEGMENT_PREFIX) and filename.endswith(SEGMENT_SUFFIX)):
+        return None
+    try:
+        return int(filename[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+    except ValueError:
+        return None
+
+
+def segment_files(directory: str) -> List[tuple]:
+    """目錄中的區段檔，依序號排序"""
+    segments = []
+    for filename in os.listdir(directory):
+        seq = segment_seq(filename)
+        if seq is not None:
+            segments.append((seq, os.path.join(directory, filename)))
+    return sorted(segments)
+
+
+def try_lock(directory: str):
+    """以非阻塞方式鎖定目錄，成功時回傳持有鎖的檔案，否則回傳 None"""
+    lock_file = open(os.path.join(directory, LOCK_FILENAME), "a")
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def read_segment(path: str) -> List[dict]:
+    """讀取區段中的記錄（包含取消記錄）；最後一行若寫入不完整（未完成 fsync 就中斷）則略過"""
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "timestamp" in record:
+                record["timestamp"] = datetime.fromisoformat(record["timestamp"])
+            records.append(record)
+    return records
+
+
+class ScanLog:
+    """掃描歷史的本機記錄檔與背景寫入執行緒"""
+
+    def __init__(self, session_factory, scan_table, workspace_model, directory: str = SCAN_LOG_DIR):
+        self.session_factory = session_factory
+        self.scan_table = scan_table
+        self.workspace_model = workspace_model
+        self.root = directory
+        self.directory: Optional[str] = None  # 本程序取得的子目錄
+
+        self._cond = threading.Condition()
+        self._file = None
+        self._lock_file = None
+        self._seq = 0
+        self._segment_records = 0  # 目前區段的筆數
+        self._written = 0          # 已寫入（尚未一定 fsync）的累計筆數
+        self._synced = 0           # 已 fsync 的累計筆數
+        self._syncing = False
+        self._sync_error: Optional[Exception] = None
+        self._running = False
+        self._threads: List[threading.Thread] = []
+        self._pending = {}         # 待確認的 event_id -> 所在區段
+        self._aborted = set()      # 已取消、尚未寫入資料庫的 event_id
+
+        self._flush_lock = threading.Lock()
+        self.flushed_total = 0
+        self.skipped_total = 0
+        self.last_flush_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.orphans_checked_at = 0.0
+        self.orphan_flushed_total = 0
+
+    # 記錄檔
+    def _segment_files(self) -> List[tuple]:
+        return segment_files(self.directory)
+
+    def _subdirectories(self) -> List[str]:
+        """SCAN_LOG_DIR 下的編號子目錄，依編號排序"""
+        numbers = sorted(int(name) for name in os.listdir(self.root) if name.isdigit())
+        return [os.path.join(self.root, str(number)) for number in numbers]
+
+    def _claim_directory(self):
+        """取得第一個沒有其他程序持有鎖的子目錄，都被佔用時建立新的子目錄"""
+        number = 0
+        while True:
+            directory = os.path.join(self.root, str(number))
+            os.makedirs(directory, exist_ok=True)
+            lock_file = try_lock(directory)
+            if lock_file is not None:
+                self.directory = directory
+                self._lock_file = lock_file
+                return
+            number += 1
+
+    def _fsync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _open_segment(self):
+        self._seq += 1
+        self._file = open(os.path.join(self.directory, segment_name(self._seq)), "a", encoding="utf-8")
+        self._segment_records = 0
+        # 確保新檔案本身在中斷後仍存在
+        self._fsync_directory()
+
+    def _rotate(self):
+        """關閉目前的區段（先完成 fsync）並開啟新區段；目前區段沒有資料時不輪替"""
+        with self._cond:
+            if self._segment_records == 0:
+                return
+            while self._syncing:
+                self._cond.wait()
+            if self._synced < self._written:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._synced = self._written
+                self._cond.notify_all()
+            self._file.close()
+            self._open_segment()
+
+    def _write_line(self, entry: dict, pending_event: Optional[str] = None):
+        """寫入一行並等待 fsync"""
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("掃描記錄檔尚未啟動")
+            self._file.write(line)
+            self._written += 1
+            self._segment_records += 1
+            if pending_event is not None:
+                self._pending[pending_event] = self._seq
+            ticket = self._written
+            self._cond.notify_all()
+            while self._synced < ticket:
+                if self._sync_error is not None:
+                    raise self._sync_error
+                self._cond.wait()
+
+    def append(self, workspace_id: int, barcode: str, result: str, timestamp: datetime,
+               pending: bool = False) -> str:
+        """寫入一筆掃描記錄，fsync 完成後回傳 event_id
+
+        pending=True 時記錄在 resolve() 或 abort() 之前不會寫入資料庫。
+        """
+        event_id = uuid.uuid4().hex
+        self._write_line({
+            "event_id": event_id,
+            "workspace_id": workspace_id,
+            "barcode": barcode,
+            "result": result,
+            "timestamp": timestamp.isoformat(),
+        }, pending_event=event_id if pending else None)
+        return event_id
+
+    def resolve(self, event_id: str):
+        """確認待確認的記錄（可重複呼叫）"""
+        with self._cond:
+            self._pending.pop(event_id, None)
+
+    def abort(self, event_id: str):
+        """取消一筆記錄：寫入取消記錄並等待 fsync，重播時同樣會略過"""
+        try:
+            self._write_line({"abort": event_id})
+        finally:
+            with self._cond:
+                self._aborted.add(event_id)
+                self._pending.pop(event_id, None)
+
+    def _sync_loop(self):
+        """收集等待中的寫入，合併成一次 fsync"""
+        while True:
+            with self._cond:
+                while self._running and self._synced == self._written:
+                    self._cond.wait()
+                if not self._running and self._synced == self._written:
+                    return
+            if SCAN_LOG_FSYNC_WINDOW > 0:
+                time.sleep(SCAN_LOG_FSYNC_WINDOW)
+            with self._cond:
+                if self._synced == self._written:
+                    continue
+                target = self._written
+                self._file.flush()
+                fd = self._file.fileno()
+                self._syncing = True
+            try:
+                os.fsync(fd)
+                error = None
+            except OSError as e:
+                error = e
+            with self._cond:
+                self._syncing = False
+                if error is None:
+                    self._synced = max(self._synced, target)
+                    self._sync_error = None
+                else:
+                    print(f"掃描記錄檔 fsync 失敗: {error}")
+                    self._sync_error = error
+                self._cond.notify_all()
+
+    # 寫入資料庫
+    def _live_workspace_ids(self, db) -> set:
+        """分區仍在的工作區；已封存或刪除的工作區無法再寫入"""
+        Workspace = self.workspace_model
+        return {
+            workspace_id for (workspace_id,) in db.query(Workspace.id).filter(
+                Workspace.status.in_([workspaces.STATUS_ACTIVE, workspaces.STATUS_CLOSED])
+            )
+        }
+
+    @staticmethod
+    def _load_aborted(directory: str) -> set:
+        """讀取目錄中所有區段的取消記錄（重播前使用，取消記錄可能在後面的區段）"""
+        aborted = set()
+        for _, path in segment_files(directory):
+            aborted.update(entry["abort"] for entry in read_segment(path) if "abort" in entry)
+        return aborted
+
+    def _write_segment(self, path: str, aborted: Optional[set] = None) -> int:
+        """寫入一個區段並刪除檔案，回傳實際寫入的筆數
+
+        aborted 為其他程序留下的取消記錄；未指定時使用本程序的取消記錄。
+        """
+        if aborted is None:
+            aborted = self._aborted
+        entries = read_segment(path)
+        with self._cond:
+            aborted = aborted | {entry["abort"] for entry in entries if "abort" in entry}
+        records = [entry for entry in entries if "abort" not in entry and entry["event_id"] not in aborted]
+        aborted_count = sum(1 for entry in entries if "abort" not in entry) - len(records)
+        db = self.session_factory()
+        try:
+            live_ids = self._live_workspace_ids(db)
+            rows = [record for record in records if record["workspace_id"] in live_ids]
+            inserted = []
+            for start in range(0, len(rows), SCAN_LOG_BATCH_SIZE):
+                statement = pg_insert(self.scan_table).values(rows[start:start + SCAN_LOG_BATCH_SIZE])
+                statement = statement.on_conflict_do_nothing(
+                    index_elements=["workspace_id", "event_id"]
+                ).returning(self.scan_table.c.event_id)
+                inserted += [event_id for (event_id,) in db.execute(statement)]
+
+            # 只累加實際寫入的記錄（重播時已存在的記錄不會重複計算）
+            records_by_event = {record["event_id"]: record for record in rows}
+            scans_by_workspace = {}
+            for event_id in inserted:
+                record = records_by_event[event_id]
+                scans_by_workspace.setdefault(record["workspace_id"], []).append(
+                    (record["timestamp"], record["result"])
+                )
+            for workspace_id, scans in sorted(scans_by_workspace.items()):
+                rollups.record_scans(db, workspace_id, scans)
+
+            # 整個區段一次提交，提交後才刪除檔案
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        os.remove(path)
+        with self._cond:
+            self._aborted.difference_update(entry.get("event_id") for entry in entries)
+
+        skipped = len(records) - len(rows)
+        if skipped:
+            print(f"掃描記錄 {skipped} 筆所屬的工作區已封存或刪除，已略過")
+        if aborted_count:
+            print(f"掃描記錄 {aborted_count} 筆已取消（計數提交失敗），已略過")
+        self.skipped_total += skipped
+        return len(inserted)
+
+    def flush(self):
+        """輪替目前的區段，並將所有已關閉的區段寫入資料庫"""
+        with self._flush_lock:
+            if self._running:
+                self._rotate()
+            with self._cond:
+                # 待確認的記錄所在的區段（及之後的區段）要等確認或取消後才寫入
+                limit = min(self._pending.values(), default=self._seq)
+            for seq, path in self._segment_files():
+                if self._running and seq >= limit:
+                    break
+                try:
+                    self.flushed_total += self._write_segment(path)
+                except Exception as e:
+                    # 保留區段檔，下次再重試
+                    self.last_error = str(e)[:500]
+                    print(f"掃描記錄寫入資料庫失敗: {e}")
+                    return
+            self.last_flush_at = time.time()
+            self.last_error = None
+            if time.time() - self.orphans_checked_at >= SCAN_LOG_ORPHAN_INTERVAL:
+                self._flush_orphans()
+
+    def _flush_orphans(self):
+        """寫入已結束的程序留下的子目錄（能取得鎖表示原本的程序已不在）"""
+        self.orphans_checked_at = time.time()
+        for directory in self._subdirectories():
+            if directory == self.directory:
+                continue
+            lock_file = try_lock(directory)
+            if lock_file is None:
+                continue
+            try:
+                leftover = segment_files(directory)
+                if not leftover:
+                    continue
+                print(f"寫入 {directory} 留下的 {len(leftover)} 個掃描記錄區段")
+                aborted = self._load_aborted(directory)
+                for _, path in leftover:
+                    self.orphan_flushed_total += self._write_segment(path, aborted)
+            except Exception as e:
+                # 保留區段檔，下次檢查時再重試
+                self.last_error = str(e)[:500]
+                print(f"掃描記錄寫入資料庫失敗（{directory}）: {e}")
+            finally:
+                lock_file.close()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: not self._running or self._segment_records >= SCAN_LOG_BATCH_SIZE,
+                    timeout=SCAN_LOG_FLUSH_INTERVAL
+                )
+                if not self._running:
+                    return
+            self.flush()
+
+    def start(self):
+        """取得子目錄並重播上次未寫入的區段（包含其他已結束程序的子目錄），再開始接受新記錄"""
+        os.makedirs(self.root, exist_ok=True)
+        self._claim_directory()
+
+        leftover = self._segment_files()
+        if leftover:
+            print(f"重播 {len(leftover)} 個未寫入的掃描記錄區段")
+            self._aborted = self._load_aborted(self.directory)
+        # 未啟動時 flush 會寫入所有區段，並檢查其他子目錄
+        self.flush()
+        if not self._segment_files():
+            self._aborted.clear()
+
+        with self._cond:
+            segments = self._segment_files()
+            self._seq = segments[-1][0] if segments else 0
+            self._open_segment()
+            self._running = True
+        self._threads = [
+            threading.Thread(target=self._sync_loop, name="scan-log-sync", daemon=True),
+            threading.Thread(target=self._flush_loop, name="scan-log-flush", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def shutdown(self):
+        """停止接受新記錄，並盡量將剩餘的記錄寫入資料庫"""
+        if not self._running:
+            return
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        with self._cond:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+        self.flush()
+        self._lock_file.close()
+        self._lock_file = None
+
+    def stats(self) -> dict:
+        with self._cond:
+            pending_segments = len(self._segment_files()) if self.directory and os.path.isdir(self.directory) else 0
+            return {
+                "enabled": self._running,
+                "directory": self.directory,
+                "pending_segments": pending_segments,
+                "current_segment_records": self._segment_records,
+                "flushed_total": self.flushed_total,
+                "skipped_total": self.skipped_total,
+                "orphan_flushed_total": self.orphan_flushed_total,
+                "last_flush_at": self.last_flush_at,
+                "last_error": self.last_error,
+            }
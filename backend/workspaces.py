@@ -0,0 +1,122 @@
+"""
+工作區（Workspace）分區管理
+
+`upload_records`、`barcodes_master`、`scan_history` 依 workspace_id 做 LIST 分區，
+每個工作區各自擁有一組分區表：
+
+- 「清空」改為切換到新的工作區，只需建立三個空分區，與資料量無關
+- 舊工作區可整個分區封存（DETACH，保留為獨立資料表供稽核）或刪除（DROP）
+
+若資料表是舊版建立的非分區表，仍可切換工作區（資料依 workspace_id 隔離），
+但刪除會退回使用 DELETE，且無法封存。
+"""
+import os
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+# 依 workspace_id 分區的資料表
+PARTITIONED_TABLES = ["upload_records", "barcodes_master", "scan_history"]
+
+# 工作區狀態
+STATUS_ACTIVE = "active"      # 目前寫入中的工作區
+STATUS_CLOSED = "closed"      # 已切換，資料仍可查詢與匯出
+STATUS_ARCHIVED = "archived"  # 分區已卸載為獨立資料表
+STATUS_DROPPED = "dropped"    # 分區已刪除
+
+# 序列化工作區切換的 advisory lock 編號
+ROTATION_LOCK_KEY = 0x57534B52
+
+
+def lock_rotation(conn: Connection):
+    """取得交易層級的 advisory lock，避免同時切換工作區而產生兩個 active 工作區"""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": ROTATION_LOCK_KEY})
+
+
+def partition_name(table: str, workspace_id: int) -> str:
+    """分區表名稱"""
+    return f"{table}_ws_{int(workspace_id)}"
+
+
+def is_partitioned(conn: Connection, table: str) -> bool:
+    """檢查資料表是否為分區表"""
+    if conn.dialect.name != "postgresql":
+        return False
+    result = conn.execute(
+        text(
+            "SELECT 1 FROM pg_partitioned_table p "
+            "JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = :table AND pg_table_is_visible(c.oid)"
+        ),
+        {"table": table},
+    )
+    return result.first() is not None
+
+
+def create_partitions(conn: Connection, workspace_id: int):
+    """為工作區建立分區（已存在則略過）"""
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(conn, table):
+            continue
+        conn.execute(text(
+            f'CREATE TABLE IF NOT EXISTS "{partition_name(table, workspace_id)}" '
+            f'PARTITION OF "{table}" FOR VALUES IN ({int(workspace_id)})'
+        ))
+
+
+def detach_partitions(conn: Connection, workspace_id: int):
+    """卸載工作區的分區，保留為獨立資料表"""
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(conn, table):
+            raise ValueError(f"資料表 {table} 未分區，無法封存")
+    for table in PARTITIONED_TABLES:
+        conn.execute(text(
+            f'ALTER TABLE "{table}" DETACH PARTITION "{partition_name(table, workspace_id)}"'
+        ))
+
+
+def drop_partitions(conn: Connection, workspace_id: int, archived: bool = False):
+    """刪除工作區的資料
+
+    分區表直接 DROP 分區；非分區表退回使用 DELETE。
+    已封存的工作區分區已卸載，直接刪除獨立資料表。
+    """
+    for table in PARTITIONED_TABLES:
+        name = partition_name(table, workspace_id)
+        if archived or is_partitioned(conn, table):
+            conn.execute(text(f'DROP TABLE IF EXISTS "{name}"'))
+        else:
+            conn.execute(
+                text(f'DELETE FROM "{table}" WHERE workspace_id = :workspace_id'),
+                {"workspace_id": int(workspace_id)},
+            )
+
+
+class ActiveWorkspaceCache:
+    """快取目前的工作區 ID，避免每次請求都查詢資料庫
+
+    本程序切換工作區時會立即更新；其他程序最多延遲 ttl 秒。
+    """
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("WORKSPACE_CACHE_TTL", "5"))
+        self._workspace_id: Optional[int] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, loader) -> int:
+        """取得工作區 ID，快取過期時呼叫 loader() 重新載入"""
+        with self._lock:
+            if self._workspace_id is None or time.monotonic() - self._loaded_at > self.ttl:
+                self._workspace_id = loader()
+                self._loaded_at = time.monotonic()
+            return self._workspace_id
+
+    def set(self, workspace_id: int):
+        with self._lock:
+            self._workspace_id = workspace_id
+            self._loaded_at = time.monotonic()
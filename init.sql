@@ -15,27 +15,43 @@ CREATE TABLE IF NOT EXISTS api_logs (
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- 1. 創建新的條碼主表（每個條碼只有一條記錄）
-CREATE TABLE IF NOT EXISTS barcodes_master (
+-- 0. 創建工作區表（清空資料改為切換工作區）
+CREATE TABLE IF NOT EXISTS workspaces (
     id SERIAL PRIMARY KEY,
-    code VARCHAR(100) NOT NULL UNIQUE,  -- 唯一約束，確保每個條碼只有一條記錄
+    name VARCHAR(100) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'active',  -- active, closed, archived, dropped
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    closed_at TIMESTAMP
+);
+
+-- 以下資料表依 workspace_id 分區，每個工作區的分區由應用程式建立
+
+-- 1. 創建新的條碼主表（每個工作區內每個條碼只有一條記錄）
+CREATE TABLE IF NOT EXISTS barcodes_master (
+    id SERIAL,
+    workspace_id INTEGER NOT NULL,       -- 所屬工作區（分區鍵）
+    code VARCHAR(100) NOT NULL,
     total_scan_count INTEGER DEFAULT 0,  -- 該條碼的總掃描次數
     last_scan_time TIMESTAMP,            -- 最後一次掃描時間
     first_upload_time TIMESTAMP,         -- 第一次上傳時間
     last_upload_time TIMESTAMP,          -- 最後一次上傳時間
     total_upload_count INTEGER DEFAULT 0, -- 總上傳次數
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (workspace_id, id),
+    CONSTRAINT uq_barcodes_master_workspace_code UNIQUE (workspace_id, code)  -- 唯一約束，確保同一工作區內每個條碼只有一條記錄
+) PARTITION BY LIST (workspace_id);
 
 -- 2. 創建上傳記錄表（記錄每次上傳）
 CREATE TABLE IF NOT EXISTS upload_records (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
+    workspace_id INTEGER NOT NULL,       -- 所屬工作區（分區鍵）
     code VARCHAR(100) NOT NULL,          -- 條碼（允許重複）
     upload_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP, -- 上傳時間
     upload_batch_id VARCHAR(50),         -- 批次ID（可選，用於區分不同批次的上傳）
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (workspace_id, id)
+) PARTITION BY LIST (workspace_id);
 
 -- 3. 為新表建立索引以提升查詢效能
 CREATE INDEX idx_barcodes_master_code ON barcodes_master(code);
@@ -48,19 +64,21 @@ RETURNS TRIGGER AS $$
 BEGIN
     -- 當新增上傳記錄時，更新或創建條碼主表記錄
     INSERT INTO barcodes_master (
+        workspace_id,
         code, 
         total_upload_count, 
         first_upload_time, 
         last_upload_time,
         updated_at
     ) VALUES (
+        NEW.workspace_id,
         NEW.code, 
         1, 
         NEW.upload_time, 
         NEW.upload_time,
         CURRENT_TIMESTAMP
     )
-    ON CONFLICT (code) DO UPDATE SET
+    ON CONFLICT (workspace_id, code) DO UPDATE SET
         total_upload_count = barcodes_master.total_upload_count + 1,
         last_upload_time = GREATEST(barcodes_master.last_upload_time, NEW.upload_time),
         first_upload_time = LEAST(barcodes_master.first_upload_time, NEW.upload_time),
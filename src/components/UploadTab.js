@@ -19,6 +19,7 @@ const UploadTab = ({ onUploadSuccess }) => {
   const [notification, setNotification] = useState(null);
   const [isLoading, setIsLoading] = useState(false);
   const [uploadResult, setUploadResult] = useState(null);
+  const [uploadProgress, setUploadProgress] = useState(null);
 
   const showNotification = (message, severity = "success") => {
     setNotification({ message, severity });
@@ -48,7 +49,7 @@ const UploadTab = ({ onUploadSuccess }) => {
     setUploadResult(null);
 
     try {
-      const response = await apiService.uploadBarcodes(barcodes);
+      const response = await apiService.uploadBarcodes(barcodes, setUploadProgress);
 
       // 使用新的回傳格式
       setUploadResult({
@@ -58,6 +59,8 @@ const UploadTab = ({ onUploadSuccess }) => {
         message: response.message,
         newBarcodes: response.new_barcodes || [],
         existingBarcodes: response.existing_barcodes || [],
+        // 條碼數量過多時，後端只回傳部分清單
+        listsTruncated: response.lists_truncated || false,
       });
 
       // 清空輸入框
@@ -70,6 +73,7 @@ const UploadTab = ({ onUploadSuccess }) => {
       showNotification("上傳失敗: " + error.message, "error");
     } finally {
       setIsLoading(false);
+      setUploadProgress(null);
     }
   };
 
@@ -129,7 +133,11 @@ const UploadTab = ({ onUploadSuccess }) => {
                 },
               }}
             >
-              {isLoading ? "上傳中..." : "上傳"}
+              {isLoading
+                ? uploadProgress !== null
+                  ? `上傳中... ${Math.round(uploadProgress * 100)}%`
+                  : "上傳中..."
+                : "上傳"}
             </Button>
           </Box>
         </CardContent>
@@ -186,7 +194,7 @@ const UploadTab = ({ onUploadSuccess }) => {
               uploadResult.newBarcodes.length > 0 && (
                 <Box sx={{ marginBottom: 2 }}>
                   <Typography variant="h6" color="success.main" gutterBottom>
-                    新增的條碼 ({uploadResult.newBarcodes.length} 個)
+                    新增的條碼 ({uploadResult.newCount} 個)
                   </Typography>
                   <Paper
                     sx={{
@@ -213,6 +221,16 @@ const UploadTab = ({ onUploadSuccess }) => {
                       ))}
                     </Stack>
                   </Paper>
+                  {uploadResult.listsTruncated &&
+                    uploadResult.newBarcodes.length < uploadResult.newCount && (
+                      <Typography
+                        variant="body2"
+                        color="text.secondary"
+                        sx={{ marginTop: 1 }}
+                      >
+                        僅顯示前 {uploadResult.newBarcodes.length} 個
+                      </Typography>
+                    )}
                 </Box>
               )}
 
@@ -221,7 +239,7 @@ const UploadTab = ({ onUploadSuccess }) => {
               uploadResult.existingBarcodes.length > 0 && (
                 <Box>
                   <Typography variant="h6" color="warning.main" gutterBottom>
-                    重複的條碼 ({uploadResult.existingBarcodes.length} 個)
+                    重複的條碼 ({uploadResult.existingCount} 個)
                   </Typography>
                   <Paper
                     sx={{
@@ -248,6 +266,16 @@ const UploadTab = ({ onUploadSuccess }) => {
                       ))}
                     </Stack>
                   </Paper>
+                  {uploadResult.listsTruncated &&
+                    uploadResult.existingBarcodes.length < uploadResult.existingCount && (
+                      <Typography
+                        variant="body2"
+                        color="text.secondary"
+                        sx={{ marginTop: 1 }}
+                      >
+                        僅顯示前 {uploadResult.existingBarcodes.length} 個
+                      </Typography>
+                    )}
                 </Box>
               )}
           </CardContent>
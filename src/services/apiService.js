@@ -2,6 +2,12 @@ import axios from "axios";
 
 const API_BASE_URL = "https://barcode-api.cloud.iletscargo.com/api";
 
+// 超過此數量的條碼改用背景工作上傳，避免同步請求超過代理逾時
+const UPLOAD_JOB_THRESHOLD = 1000;
+const JOB_POLL_INTERVAL = 1000;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
 const api = axios.create({
   baseURL: API_BASE_URL,
   headers: {
@@ -22,17 +28,38 @@ export const apiService = {
     return response.data;
   },
 
-  // 批量上傳條碼
-  uploadBarcodes: async (codes) => {
+  // 批量上傳條碼（數量較多時建立背景工作並輪詢進度，onProgress 會收到 0 ~ 1 的進度）
+  uploadBarcodes: async (codes, onProgress) => {
+    let job;
     try {
-      const response = await api.post("/barcodes/bulk", { codes });
-      return response.data;
+      if (codes.length <= UPLOAD_JOB_THRESHOLD) {
+        const response = await api.post("/barcodes/bulk", { codes });
+        return response.data;
+      }
+
+      job = (await api.post("/jobs/upload", { codes })).data;
+      while (!["succeeded", "failed", "cancelled"].includes(job.status)) {
+        if (onProgress) onProgress(job.progress);
+        await sleep(JOB_POLL_INTERVAL);
+        job = (await api.get(`/jobs/${job.id}`)).data;
+      }
     } catch (error) {
       if (error.response && error.response.data && error.response.data.detail) {
         throw new Error(error.response.data.detail);
       }
       throw new Error("批量上傳條碼失敗");
     }
+
+    if (job.status !== "succeeded") {
+      throw new Error(job.error || "批量上傳條碼失敗");
+    }
+    // 背景工作只回傳數量，不含條碼清單
+    return {
+      ...job.result,
+      new_barcodes: [],
+      existing_barcodes: [],
+      lists_truncated: true,
+    };
   },
 
   // 刪除條碼